@@ -12,6 +12,13 @@ with col2:
 check_authentication()
 user = st.experimental_user.name
 
+# Los trabajadores arrancan con la app: los trabajos y filas pendientes de un proceso anterior se
+# retoman sin esperar a que alguien envíe una nueva solicitud
+from finalize_jobs import get_finalize_worker
+from write_queue import get_write_worker
+get_finalize_worker()
+get_write_worker()
+
 with st.sidebar:
     page = st.radio("Go to", ["Home", "Contracts Management", "Your Quotations", "Request your Quotes"])
 
@@ -0,0 +1,134 @@
+import functools
+import threading
+import time
+from collections import OrderedDict
+
+from write_queue import add_flush_hook
+
+DEFAULT_MAX_ENTRIES = 64
+
+# Un solo registro de regiones por proceso, compartido entre todas las sesiones. Es un dict de módulo
+# (no st.cache_resource) porque los hooks de la cola de escritura lo usan desde su propio hilo.
+_state = {"lock": threading.RLock(), "regions": {}}
+
+
+def define_region(name, max_entries=DEFAULT_MAX_ENTRIES, ttl=None):
+    with _state["lock"]:
+        region = _state["regions"].setdefault(name, {
+            "entries": OrderedDict(),
+            "version": 0,
+            "key_versions": {},
+            "hits": 0,
+            "misses": 0,
+            "evictions": 0,
+            "invalidations": 0,
+        })
+        region.update(max_entries=max_entries, ttl=ttl)
+        return region
+
+
+def _region(name):
+    region = _state["regions"].get(name)
+    if region is None:
+        region = define_region(name)
+    return region
+
+
+def _current(region, deps):
+    # Versión de cada llave de la que depende una entrada (p. ej. (spreadsheet_id, pestaña))
+    return {dep: region["key_versions"].get(dep, 0) for dep in deps}
+
+
+def _lookup(region, key):
+    entry = region["entries"].get(key)
+    if entry is None or entry["version"] != region["version"]:
+        return None
+    if entry["deps"] is not None and entry["deps"] != _current(region, entry["deps"]):
+        return None
+    if region["ttl"] is not None and time.time() - entry["stored_at"] > region["ttl"]:
+        return None
+    region["entries"].move_to_end(key)
+    return entry
+
+
+def cached(region_name, keys=None):
+    # Como st.cache_data, pero el valor se comparte (no se copia) y se invalida por región o por llave.
+    # keys(*args, **kwargs) devuelve las llaves de datos de las que depende el resultado; sin keys,
+    # la entrada se invalida con cualquier escritura que llegue a la región.
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            key = (func.__qualname__, args, tuple(sorted(kwargs.items())))
+            deps = tuple(keys(*args, **kwargs)) if keys is not None else None
+            region = _region(region_name)
+            with _state["lock"]:
+                entry = _lookup(region, key)
+                if entry is not None:
+                    region["hits"] += 1
+                    return entry["value"]
+                region["misses"] += 1
+                version = region["version"]
+                dep_versions = _current(region, deps) if deps is not None else None
+
+            value = func(*args, **kwargs)
+
+            with _state["lock"]:
+                # Si la región o alguna llave se invalidó mientras se calculaba, el valor ya nació viejo
+                if version == region["version"] and (deps is None or dep_versions == _current(region, deps)):
+                    region["entries"][key] = {
+                        "value": value, "version": version, "deps": dep_versions, "stored_at": time.time()
+                    }
+                    region["entries"].move_to_end(key)
+                    while len(region["entries"]) > region["max_entries"]:
+                        region["entries"].popitem(last=False)
+                        region["evictions"] += 1
+            return value
+
+        wrapper.invalidate = lambda key=None: invalidate(region_name, key)
+        return wrapper
+
+    return decorator
+
+
+def invalidate(region_name, key=None):
+    # Sin llave se vacía la región; con llave solo salen las entradas que dependen de ella
+    with _state["lock"]:
+        region = _region(region_name)
+        region["invalidations"] += 1
+        if key is None:
+            region["version"] += 1
+            region["entries"].clear()
+            return
+        region["key_versions"][key] = region["key_versions"].get(key, 0) + 1
+        for entry_key, entry in list(region["entries"].items()):
+            if entry["deps"] is None or key in entry["deps"]:
+                del region["entries"][entry_key]
+
+
+def invalidate_on_write(region_name, spreadsheet_id, sheet_name):
+    # Cuando la cola de escritura confirma filas en esa pestaña, salen solo las entradas que la leen
+    def hook(flushed_spreadsheet_id, sheet_names):
+        if flushed_spreadsheet_id == spreadsheet_id and sheet_name in sheet_names:
+            invalidate(region_name, (spreadsheet_id, sheet_name))
+
+    add_flush_hook(f"cache:{region_name}:{spreadsheet_id}:{sheet_name}", hook)
+
+
+def cache_stats():
+    with _state["lock"]:
+        stats = []
+        for name, region in sorted(_state["regions"].items()):
+            lookups = region["hits"] + region["misses"]
+            stats.append({
+                "Region": name,
+                "Entries": len(region["entries"]),
+                "Max entries": region["max_entries"],
+                "Version": region["version"],
+                "Tracked keys": len(region["key_versions"]),
+                "Hits": region["hits"],
+                "Misses": region["misses"],
+                "Hit rate": round(region["hits"] / lookups, 3) if lookups else None,
+                "Evictions": region["evictions"],
+                "Invalidations": region["invalidations"],
+            })
+        return stats
@@ -0,0 +1,67 @@
+import threading
+
+import google_auth_httplib2
+import gspread
+import httplib2
+import streamlit as st
+from google.oauth2.service_account import Credentials
+from googleapiclient.discovery import build
+from googleapiclient.http import HttpRequest
+
+SHEETS_SCOPES = (
+    "https://www.googleapis.com/auth/spreadsheets",
+    "https://www.googleapis.com/auth/drive",
+)
+DRIVE_SCOPES = ("https://www.googleapis.com/auth/drive",)
+
+HTTP_TIMEOUT = 60
+
+_local = threading.local()
+
+
+@st.cache_resource
+def get_credentials(secret_name, scopes=SHEETS_SCOPES):
+    # Una sola instancia por proceso: el token se refresca una vez y lo reutilizan todas las sesiones
+    return Credentials.from_service_account_info(st.secrets[secret_name], scopes=list(scopes))
+
+
+@st.cache_resource
+def get_gspread_client(secret_name="google_sheets_credentials", scopes=SHEETS_SCOPES):
+    # gspread usa una requests.Session con pool de conexiones y keep-alive
+    return gspread.authorize(get_credentials(secret_name, scopes))
+
+
+def _thread_http(credentials):
+    # httplib2 no es thread-safe: cada hilo usa su propia conexión autorizada
+    pool = getattr(_local, "http", None)
+    if pool is None:
+        pool = _local.http = {}
+    key = id(credentials)
+    if key not in pool:
+        pool[key] = google_auth_httplib2.AuthorizedHttp(credentials, http=httplib2.Http(timeout=HTTP_TIMEOUT))
+    return pool[key]
+
+
+@st.cache_resource
+def get_service(api, version, secret_name, scopes):
+    credentials = get_credentials(secret_name, scopes)
+
+    def request_builder(http, *args, **kwargs):
+        return HttpRequest(_thread_http(credentials), *args, **kwargs)
+
+    # El documento de descubrimiento viene empaquetado en la librería: se construye una sola vez
+    return build(
+        api, version,
+        http=_thread_http(credentials),
+        requestBuilder=request_builder,
+        cache_discovery=False
+    )
+
+
+def get_sheets_service(secret_name="google_sheets_credentials"):
+    return get_service("sheets", "v4", secret_name, SHEETS_SCOPES)
+
+
+def get_drive_service(secret_name="google_drive_credentials"):
+    scopes = DRIVE_SCOPES if secret_name == "google_drive_credentials" else SHEETS_SCOPES
+    return get_service("drive", "v3", secret_name, scopes)
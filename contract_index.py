@@ -0,0 +1,70 @@
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+from pricing import price_frame
+
+EXCLUDED_STATES = ["NO APROBADO", "EN PAUSA"]
+DATE_FORMAT = "%d/%m/%Y"
+LANE_COLUMNS = ["POL", "POD", "COMMODITIES"]
+_NO_ROWS = np.empty(0, dtype=np.intp)
+
+
+def build_lane_index(df):
+    # POL -> POD -> commodity -> posiciones de fila, en el orden de aparición de la tabla
+    keys = df[LANE_COLUMNS].reset_index(drop=True)
+    groups = keys.groupby(LANE_COLUMNS, sort=False, dropna=False).indices
+    lanes = {}
+    for (pol, pod, commodity), rows in sorted(groups.items(), key=lambda item: item[1][0]):
+        commodities = lanes.setdefault(pol, {}).setdefault(pod, {})
+        # Las filas sin commodity no se pueden seleccionar, pero el POL/POD sí aparece
+        if not pd.isna(commodity):
+            commodities[commodity] = rows
+    return lanes
+
+
+def _prepare(df):
+    df = df.copy()
+    df["POL"] = df["POL"].astype(str)
+    df["POD"] = df["POD"].astype(str)
+    df["FECHA FIN FLETE"] = pd.to_datetime(
+        df["FECHA FIN FLETE"].astype(str).str.strip(), format=DATE_FORMAT, errors="coerce"
+    )
+    return df
+
+
+def build_contracts_view(contratos_df, tarifas_scrap):
+    contratos_df = _prepare(contratos_df[~contratos_df["Estado"].isin(EXCLUDED_STATES)])
+    tarifas_scrap = _prepare(tarifas_scrap)
+
+    # Llaves en el orden de CONTENEDORES: el resultado del merge no depende del hash de un set
+    common_columns = [col for col in contratos_df.columns if col in tarifas_scrap.columns]
+    merged_df = pd.merge(contratos_df, tarifas_scrap, on=common_columns, how="outer")
+    merged_df = price_frame(merged_df)
+    return {"merged": merged_df, "lanes": build_lane_index(merged_df)}
+
+
+@st.cache_resource(max_entries=2)
+def load_contracts_view(version, _contratos_df, _tarifas_scrap):
+    # Compartido entre sesiones y recalculado solo cuando cambia la versión del snapshot
+    return build_contracts_view(_contratos_df, _tarifas_scrap)
+
+
+def lane_pols(lanes):
+    return list(lanes)
+
+
+def lane_pods(lanes, pol):
+    return list(lanes.get(pol, {}))
+
+
+def lane_commodities(lanes, pol, pod):
+    return list(lanes.get(pol, {}).get(pod, {}))
+
+
+def lane_rows(lanes, pol, pod, commodities):
+    by_commodity = lanes.get(pol, {}).get(pod, {})
+    rows = [by_commodity[commodity] for commodity in commodities if commodity in by_commodity]
+    if not rows:
+        return _NO_ROWS
+    return np.sort(np.concatenate(rows))
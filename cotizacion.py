@@ -1,98 +1,233 @@
-import xlwings as xw
+import copy
 import datetime
-from auth import user_data
-import streamlit as st
-
-def generate_quotation(data):
-    ruta_plantilla = "plantilla.xlsx"
-    app = xw.App(visible=False) 
-    wb = app.books.open(ruta_plantilla)
-    hoja = wb.sheets["Hoja1"]
+import json
+import os
+from io import BytesIO
 
-    def escribir_en_celda(celda, valor, bold=False):
-        rng = hoja.range(celda)  
-        if rng.merge_cells:
-            rng = hoja.range(rng.merge_area.address)
-        rng.value = valor
+import streamlit as st
+from openpyxl import load_workbook
+from openpyxl.utils import column_index_from_string, coordinate_to_tuple
+from auth import user_data
 
-        try:
-            if bold:
-                rng.api.FontObject.Bold = True  # 🔹 Solución: Usar FontObject en lugar de Font
-        except AttributeError:
-            pass
+TEMPLATE_SPEC = "plantilla.json"
+
+
+@st.cache_resource
+def _read_spec(spec_path, mtime):
+    with open(spec_path, "r", encoding="utf-8") as file:
+        return json.load(file)
+
+
+def _anchor(hoja, row, column):
+    # Las celdas combinadas solo aceptan valores en la esquina superior izquierda
+    for rango in hoja.merged_cells.ranges:
+        if rango.min_row <= row <= rango.max_row and rango.min_col <= column <= rango.max_col:
+            return rango.min_row, rango.min_col
+    return row, column
+
+
+def _compile_region(name, region):
+    return {
+        "name": name,
+        "first_row": region["first_row"],
+        "last_row": region["last_row"],
+        "columns": {key: column_index_from_string(col) for key, col in region["columns"].items()},
+        "totals": {
+            "label": region.get("totals", {}).get("label", "Total"),
+            "label_column": column_index_from_string(region.get("totals", {}).get("label_column", "B")),
+            "columns": {
+                key: column_index_from_string(col)
+                for key, col in region.get("totals", {}).get("columns", {}).items()
+            },
+            "bold": region.get("totals", {}).get("bold", False),
+        },
+    }
+
+
+@st.cache_resource(max_entries=4)
+def compile_template(spec_path, spec_mtime, template_mtime):
+    # Se compila una vez por versión de la plantilla: direcciones resueltas y un libro base sin datos
+    spec = _read_spec(spec_path, spec_mtime)
+    template_path = os.path.join(os.path.dirname(spec_path), spec["template"])
+    wb = load_workbook(template_path)
+    hoja = wb[spec["sheet"]]
+
+    fields = {}
+    for name, field in spec["fields"].items():
+        if isinstance(field, str):
+            field = {"cell": field}
+        row, column = _anchor(hoja, *coordinate_to_tuple(field["cell"]))
+        fields[name] = {"row": row, "column": column, "bold": field.get("bold", False), "wrap": field.get("wrap", False)}
+
+    regions = sorted(
+        (_compile_region(name, region) for name, region in spec.get("regions", {}).items()),
+        key=lambda region: region["first_row"]
+    )
+    for region in regions:
+        for row in hoja.iter_rows(min_row=region["first_row"], max_row=region["last_row"]):
+            for cell in row:
+                if cell.coordinate not in hoja.merged_cells:
+                    cell.value = None
+
+    skeleton = BytesIO()
+    wb.save(skeleton)
+    return {"sheet": spec["sheet"], "fields": fields, "regions": regions, "skeleton": skeleton.getvalue()}
+
+
+def load_template(spec_path=TEMPLATE_SPEC):
+    spec = _read_spec(spec_path, os.path.getmtime(spec_path))
+    template_path = os.path.join(os.path.dirname(spec_path), spec["template"])
+    return compile_template(spec_path, os.path.getmtime(spec_path), os.path.getmtime(template_path))
+
+
+def _write(hoja, row, column, value, bold=False, wrap=False):
+    row, column = _anchor(hoja, row, column)
+    cell = hoja.cell(row=row, column=column)
+    cell.value = value
+    if bold:
+        font = copy.copy(cell.font)
+        font.bold = True
+        cell.font = font
+    if wrap:
+        alignment = copy.copy(cell.alignment)
+        alignment.wrap_text = True
+        cell.alignment = alignment
+
+
+def _insert_rows(hoja, after_row, amount):
+    # insert_rows de openpyxl no mueve rangos combinados ni alturas: se corren a mano
+    hoja.insert_rows(after_row + 1, amount)
+    for rango in hoja.merged_cells.ranges:
+        if rango.min_row > after_row:
+            rango.shift(row_shift=amount)
+
+    heights = {row: dim.height for row, dim in hoja.row_dimensions.items() if row > after_row and dim.height}
+    for row in heights:
+        hoja.row_dimensions[row].height = None
+    for row, height in heights.items():
+        hoja.row_dimensions[row + amount].height = height
+
+    # Las filas nuevas toman el formato de la última fila de la región
+    for column in range(1, hoja.max_column + 1):
+        source = hoja.cell(row=after_row, column=column)
+        for row in range(after_row + 1, after_row + amount + 1):
+            hoja.cell(row=row, column=column)._style = copy.copy(source._style)
+    if after_row in hoja.row_dimensions and hoja.row_dimensions[after_row].height:
+        for row in range(after_row + 1, after_row + amount + 1):
+            hoja.row_dimensions[row].height = hoja.row_dimensions[after_row].height
+
+
+def render_template(compiled, values, tables):
+    wb = load_workbook(BytesIO(compiled["skeleton"]))
+    hoja = wb[compiled["sheet"]]
+
+    inserted = []
+
+    def shifted(row):
+        return row + sum(amount for after_row, amount in inserted if row > after_row)
+
+    for region in compiled["regions"]:
+        table = tables.get(region["name"], {})
+        lines = table.get("lines", [])
+        totals = table.get("totals", [])
+
+        first_row, last_row = shifted(region["first_row"]), shifted(region["last_row"])
+        needed = len(lines) + max(len(totals), 1)
+        extra = needed - (last_row - first_row + 1)
+        if extra > 0:
+            _insert_rows(hoja, last_row, extra)
+            inserted.append((region["last_row"], extra))
+
+        row = first_row
+        for line in lines:
+            for key, column in region["columns"].items():
+                _write(hoja, row, column, line.get(key))
+            row += 1
+
+        spec = region["totals"]
+        _write(hoja, row, spec["label_column"], spec["label"], bold=spec["bold"])
+        for offset, total in enumerate(totals):
+            for key, column in spec["columns"].items():
+                _write(hoja, row + offset, column, total.get(key), bold=spec["bold"])
+
+    for name, field in compiled["fields"].items():
+        if name in values:
+            _write(hoja, shifted(field["row"]), field["column"], values[name], field["bold"], field["wrap"])
 
+    output = BytesIO()
+    wb.save(output)
+    output.seek(0)
+    return output
 
-    commercial_data = user_data()
-    escribir_en_celda("F4", commercial_data.get("name", "N/A")) 
-    escribir_en_celda("F5", commercial_data.get("position", "N/A"))  
-    escribir_en_celda("F6", commercial_data.get("tel", "N/A"))  
-    escribir_en_celda("F7", commercial_data.get("email", "N/A"))  
 
-    escribir_en_celda("C10", datetime.datetime.today().strftime("%d/%m/%Y"))  
-    escribir_en_celda("G10", (datetime.datetime.today() + datetime.timedelta(days=30)).strftime("%d/%m/%Y"))  
+def _amount(value):
+    # Los recargos llegan como {"cost": x, "sale": y}; en la cotización se muestra la venta
+    if isinstance(value, dict):
+        value = value.get("sale")
+    return value if isinstance(value, (int, float)) else 0
 
-    escribir_en_celda("B13", data.get("client", "N/A"))  
-    #escribir_en_celda("B16", data.get("reference", "N/A"))  preguntar por la referencia
 
-    escribir_en_celda("C19", data.get("incoterm", "N/A"))  
+def quotation_context(data, commercial_data):
     details = data.get("Details", {})
-    escribir_en_celda("C20", details.get("Commodities", "N/A"))  
-    escribir_en_celda("C22", ", ".join(data.get("cargo_type", [])))  
+    cargo_types = data.get("cargo_types", data.get("cargo_type", []))
+    if isinstance(cargo_types, str):
+        cargo_types = [cargo_types]
 
-    escribir_en_celda("C21", f"{data.get('POL', 'N/A')} - {data.get('POD', 'N/A')}")  
-    escribir_en_celda("C22", data.get("cargo_type", "N/A"))  
-
-    rate_table = data.get("surcharges", {})
-    fila_inicio = 25
+    lines = []
     total_costos = {}
-
-    for concepto, valores in rate_table.items():
-        for container_type, amount in valores.items():
-            if isinstance(amount, (int, float)) and amount > 0:
-                hoja.range(f"B{fila_inicio}").value = concepto.upper()  
-                hoja.range(f"D{fila_inicio}").value = container_type  
-                hoja.range(f"F{fila_inicio}").value = amount  
-                total_costos[container_type] = total_costos.get(container_type, 0) + amount  
-                fila_inicio += 1  
-
-    escribir_en_celda(f"B{fila_inicio}", "Total", bold=True)
-    for idx, (container_type, total) in enumerate(total_costos.items()):
-        escribir_en_celda(f"D{fila_inicio + idx}", container_type, bold=True)
-        escribir_en_celda(f"F{fila_inicio + idx}", total, bold=True)
-
+    for concepto, valores in data.get("surcharges", {}).items():
+        for container_type, value in valores.items():
+            amount = _amount(value)
+            if amount > 0:
+                lines.append({"concept": concepto.upper(), "container": container_type, "amount": amount})
+                total_costos[container_type] = total_costos.get(container_type, 0) + amount
 
     # NOTAS
-    transit_time_info = ( 
-        f"Transit Time: {data.get("Details", {}).get("Transit Time", "N/A")} days \n"
-        f"Route: {data.get("Details", {}).get("Route", "N/A")} \n"
-        f"Free Days in Origin: {data.get("Details", {}).get("Free Days in Origin", "N/A")} \n"
-        f"Free Days in Destination: {data.get("Details", {}).get("Free Days in Destination", "N/A")} \n"
-        f"Notes: {data.get("Details", {}).get("Notes", " ")}"
+    transit_time_info = (
+        f"Transit Time: {details.get('Transit Time', 'N/A')} days \n"
+        f"Route: {details.get('Route', 'N/A')} \n"
+        f"Free Days in Origin: {details.get('Free Days in Origin', 'N/A')} \n"
+        f"Free Days in Destination: {details.get('Free Days in Destination', 'N/A')} \n"
+        f"Notes: {details.get('Notes', ' ')}"
     )
 
-    escribir_en_celda("B33", transit_time_info)  
-    hoja.range("B33").api.WrapText = True
-
-    output = BytesIO()
-    temp_file = os.path.expanduser("~/Documents/forms upgraded/cotizacion_temp.xlsx")
+    values = {
+        "commercial_name": commercial_data.get("name", "N/A"),
+        "commercial_position": commercial_data.get("position", "N/A"),
+        "commercial_tel": commercial_data.get("tel", "N/A"),
+        "commercial_email": commercial_data.get("email", "N/A"),
+        "issue_date": datetime.datetime.today().strftime("%d/%m/%Y"),
+        "valid_until": (datetime.datetime.today() + datetime.timedelta(days=30)).strftime("%d/%m/%Y"),
+        "client": data.get("client", "N/A"),
+        #"reference": data.get("reference", "N/A"),  preguntar por la referencia
+        "incoterm": data.get("incoterm", "N/A"),
+        "commodity": data.get("commodity") or details.get("Commodities", "N/A"),
+        "route": f"{data.get('pol', data.get('POL', 'N/A'))} - {data.get('pod', data.get('POD', 'N/A'))}",
+        "cargo_types": ", ".join(cargo_types),
+        "notes": transit_time_info,
+    }
+    tables = {
+        "surcharges": {
+            "lines": lines,
+            "totals": [{"container": container, "amount": total} for container, total in total_costos.items()],
+        }
+    }
+
+    return values, tables
 
-    try:
-        wb.save(temp_file) 
-        wb.close()
-        app.quit()
 
-        with open(temp_file, "rb") as f:
-            output.write(f.read())
-
-        output.seek(0) 
+def generate_quotation(data):
+    return render_template(load_template(), *quotation_context(data, user_data()))
 
-    except Exception as e:
-        print(f"Error al guardar el archivo: {e}")
-        wb.close()
-        app.quit()
-        return None
 
-    finally:
-        if os.path.exists(temp_file):
-            os.remove(temp_file)
-    return output
+def generate_quotations(quotations):
+    # openpyxl es Python puro: en hilos el GIL serializa el render, así que se hace en secuencia.
+    # Cada documento se entrega antes de renderizar el siguiente, de modo que solo hay uno en memoria.
+    # Devuelve (datos, documento | excepción) para que un cliente con error no corte el lote.
+    compiled = load_template()
+    commercial_data = user_data()
+    for data in quotations:
+        try:
+            yield data, render_template(compiled, *quotation_context(data, commercial_data))
+        except Exception as e:
+            yield data, e
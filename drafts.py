@@ -0,0 +1,37 @@
+import copy
+
+import streamlit as st
+
+DRAFT_KEY = "draft_services"
+
+
+def load_draft():
+    # El borrador vive solo en la sesión: se reinicia al entrar a la página y al finalizar
+    if DRAFT_KEY not in st.session_state:
+        st.session_state[DRAFT_KEY] = []
+    return st.session_state[DRAFT_KEY]
+
+
+def save_draft(services):
+    # Copia propia para que los cambios en st.session_state["services"] no alteren el borrador
+    st.session_state[DRAFT_KEY] = copy.deepcopy(list(services))
+
+
+def upsert_draft_service(service, index=None):
+    services = load_draft()
+    if index is not None and 0 <= index < len(services):
+        services[index] = copy.deepcopy(service)
+    else:
+        index = len(services)
+        services.append(copy.deepcopy(service))
+    return index
+
+
+def remove_draft_service(index):
+    services = load_draft()
+    if 0 <= index < len(services):
+        del services[index]
+
+
+def reset_draft():
+    st.session_state[DRAFT_KEY] = []
@@ -0,0 +1,137 @@
+import hashlib
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from googleapiclient.errors import HttpError
+from googleapiclient.http import MediaFileUpload
+
+from local_store import get_connection
+from resilience import resilient_call
+
+UPLOAD_WORKERS = 4
+UPLOAD_CHUNK_SIZE = 5 * 1024 * 1024
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS upload_sessions (
+    md5 TEXT NOT NULL,
+    folder_id TEXT NOT NULL,
+    file_name TEXT NOT NULL,
+    resumable_uri TEXT NOT NULL,
+    progress INTEGER NOT NULL,
+    PRIMARY KEY (md5, folder_id)
+)
+"""
+
+
+def _connection():
+    conn = get_connection()
+    conn.execute(_SCHEMA)
+    return conn
+
+
+def file_md5(file_path):
+    md5 = hashlib.md5()
+    with open(file_path, "rb") as file:
+        for chunk in iter(lambda: file.read(1024 * 1024), b""):
+            md5.update(chunk)
+    return md5.hexdigest()
+
+
+def existing_checksums(drive_service, folder_id):
+    checksums = set()
+    page_token = None
+    while True:
+        response = resilient_call("drive", drive_service.files().list(
+            q=f"'{folder_id}' in parents and trashed = false",
+            fields="nextPageToken, files(md5Checksum)",
+            supportsAllDrives=True,
+            includeItemsFromAllDrives=True,
+            pageToken=page_token
+        ).execute)
+        checksums.update(f["md5Checksum"] for f in response.get("files", []) if f.get("md5Checksum"))
+        page_token = response.get("nextPageToken")
+        if not page_token:
+            return checksums
+
+
+def _saved_session(md5, folder_id):
+    return _connection().execute(
+        "SELECT resumable_uri, progress FROM upload_sessions WHERE md5 = ? AND folder_id = ?", (md5, folder_id)
+    ).fetchone()
+
+
+def _save_session(md5, folder_id, file_name, resumable_uri, progress):
+    with _connection() as conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO upload_sessions (md5, folder_id, file_name, resumable_uri, progress) "
+            "VALUES (?, ?, ?, ?, ?)",
+            (md5, folder_id, file_name, resumable_uri, progress)
+        )
+
+
+def _drop_session(md5, folder_id):
+    with _connection() as conn:
+        conn.execute("DELETE FROM upload_sessions WHERE md5 = ? AND folder_id = ?", (md5, folder_id))
+
+
+def upload_file(drive_service, folder_id, file_path, md5, on_progress=None, resume=True):
+    file_name = os.path.basename(file_path)
+    media = MediaFileUpload(file_path, chunksize=UPLOAD_CHUNK_SIZE, resumable=True)
+    request = drive_service.files().create(
+        body={'name': file_name, 'parents': [folder_id]},
+        media_body=media,
+        fields='id',
+        supportsAllDrives=True
+    )
+
+    saved = _saved_session(md5, folder_id) if resume else None
+    if saved:
+        # Retoma la sesión reanudable que quedó abierta en una ejecución anterior
+        request.resumable_uri, request.resumable_progress = saved
+
+    response = None
+    try:
+        while response is None:
+            status, response = resilient_call("drive.upload", request.next_chunk)
+            if status:
+                _save_session(md5, folder_id, file_name, request.resumable_uri, status.resumable_progress)
+                if on_progress:
+                    on_progress(file_path, status.progress())
+    except HttpError as e:
+        if saved and e.resp.status in (404, 410):
+            # La sesión expiró en Drive: se empieza de nuevo
+            _drop_session(md5, folder_id)
+            return upload_file(drive_service, folder_id, file_path, md5, on_progress, resume=False)
+        raise
+
+    _drop_session(md5, folder_id)
+    if on_progress:
+        on_progress(file_path, 1.0)
+    return response
+
+
+def upload_files(drive_service, folder_id, file_paths, on_progress=None, max_workers=UPLOAD_WORKERS):
+    # Devuelve {ruta: "uploaded" | "duplicate" | excepción}
+    existing = existing_checksums(drive_service, folder_id)
+    results = {}
+    pending = {}
+    for file_path in file_paths:
+        md5 = file_md5(file_path)
+        if md5 in existing or md5 in pending.values():
+            results[file_path] = "duplicate"
+        else:
+            pending[file_path] = md5
+
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="drive-upload") as executor:
+        futures = {
+            file_path: executor.submit(upload_file, drive_service, folder_id, file_path, md5, on_progress)
+            for file_path, md5 in pending.items()
+        }
+        for file_path, future in futures.items():
+            try:
+                future.result()
+                results[file_path] = "uploaded"
+            except Exception as e:
+                results[file_path] = e
+
+    return results
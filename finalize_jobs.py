@@ -0,0 +1,269 @@
+import json
+import logging
+import os
+import random
+import shutil
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import pandas as pd
+import streamlit as st
+
+from clients import get_drive_service
+from drive_uploads import upload_files
+from local_store import get_connection
+from resilience import RESET_TIMEOUT, CircuitOpenError, resilient_call
+from spool import clear_spool, spool_files
+from utils import PARENT_FOLDER_ID, all_quotes_columns, log_time, save_to_google_sheets, sheet_id, time_sheet_id
+from write_queue import enqueue_rows, retry_rows, row_status
+
+JOBS_ROOT = os.path.join(".cache", "finalize_jobs")
+POLL_INTERVAL = 5
+JOB_WORKERS = 2
+MAX_ATTEMPTS = 8
+RETRY_DELAY = 5
+MAX_RETRY_DELAY = 600
+
+ACTIVE_STATUSES = ("submitting", "pending", "running")
+
+logger = logging.getLogger(__name__)
+
+
+class DuplicateJobError(RuntimeError):
+    pass
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS finalize_jobs (
+    request_id TEXT PRIMARY KEY,
+    payload_json TEXT NOT NULL,
+    job_dir TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    step TEXT NOT NULL DEFAULT 'folder',
+    folder_id TEXT,
+    folder_link TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    last_error TEXT,
+    next_attempt_at REAL NOT NULL,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+)
+"""
+
+
+def _connection():
+    conn = get_connection()
+    conn.execute(_SCHEMA)
+    return conn
+
+
+def _update(request_id, **columns):
+    columns["updated_at"] = time.time()
+    assignments = ", ".join(f"{col} = ?" for col in columns)
+    with _connection() as conn:
+        conn.execute(f"UPDATE finalize_jobs SET {assignments} WHERE request_id = ?",
+                     (*columns.values(), request_id))
+
+
+def submit_finalize_job(request_id, payload, spool_dir=None):
+    job_dir = os.path.join(JOBS_ROOT, request_id)
+    now = time.time()
+    try:
+        with _connection() as conn:
+            conn.execute(
+                "INSERT INTO finalize_jobs (request_id, payload_json, job_dir, status, next_attempt_at, created_at, updated_at) "
+                "VALUES (?, ?, ?, 'submitting', ?, ?, ?)",
+                (request_id, json.dumps(payload, default=str), job_dir, now, now, now)
+            )
+    except sqlite3.IntegrityError:
+        raise DuplicateJobError(f"Request {request_id} already exists and was not submitted again.") from None
+
+    # Los adjuntos pasan a la carpeta del trabajo solo cuando la fila existe: la limpieza del spool
+    # de la sesión ya no los alcanza. Mientras está 'submitting' el trabajador no lo toma.
+    os.makedirs(job_dir, exist_ok=True)
+    for file_path in spool_files(spool_dir) if spool_dir else []:
+        shutil.move(file_path, os.path.join(job_dir, os.path.basename(file_path)))
+    _update(request_id, status="pending")
+    get_finalize_worker()["event"].set()
+
+
+def job_status(request_id):
+    row = _connection().execute(
+        "SELECT status, step, folder_link, attempts, last_error FROM finalize_jobs WHERE request_id = ?", (request_id,)
+    ).fetchone()
+    if row is None:
+        return None
+    status, step, folder_link, attempts, last_error = row
+    progress = get_finalize_worker()["progress"].get(request_id)
+    return {
+        "status": status,
+        "step": step,
+        "folder_link": folder_link,
+        "attempts": attempts,
+        "last_error": last_error,
+        "progress": sum(progress.values()) / len(progress) if progress else None,
+    }
+
+
+def retry_finalize_job(request_id):
+    with _connection() as conn:
+        conn.execute(
+            "UPDATE finalize_jobs SET status = 'pending', attempts = 0, next_attempt_at = ?, updated_at = ? "
+            "WHERE request_id = ? AND status = 'failed'",
+            (time.time(), time.time(), request_id)
+        )
+    get_finalize_worker()["event"].set()
+
+
+def _ensure_folder(drive_service, folder_name, parent_folder_id):
+    # Se busca antes de crear y la creación no se reintenta aquí: si se perdió la respuesta, el siguiente
+    # intento del trabajo vuelve a buscar y encuentra la carpeta en lugar de crear otra
+    response = resilient_call("drive", drive_service.files().list(
+        q=f"name = '{folder_name}' and mimeType = 'application/vnd.google-apps.folder' "
+          f"and '{parent_folder_id}' in parents and trashed = false",
+        fields="files(id)",
+        supportsAllDrives=True,
+        includeItemsFromAllDrives=True
+    ).execute)
+    files = response.get("files", [])
+    if files:
+        return files[0]["id"]
+
+    folder = resilient_call("drive", drive_service.files().create(
+        body={
+            "name": folder_name,
+            "mimeType": "application/vnd.google-apps.folder",
+            "parents": [parent_folder_id]
+        },
+        fields="id",
+        supportsAllDrives=True
+    ).execute, idempotent=False)
+    return folder["id"]
+
+
+def _save_rows(request_id, payload, folder_link):
+    # Todas las filas llevan clave de idempotencia en la cola: repetir el paso no duplica nada
+    record = dict(payload["record"], request_id=f'=HYPERLINK("{folder_link}"; "{request_id}")')
+    keys = save_to_google_sheets(pd.DataFrame([record]).reindex(columns=all_quotes_columns, fill_value=""), sheet_id)
+
+    keys += log_time(datetime.fromisoformat(payload["start_time"]), datetime.fromisoformat(payload["end_time"]),
+                     payload["duration"], request_id, quotation_type="Requested Quotation") or []
+
+    client = payload.get("new_client")
+    if client:
+        client_keys = [f"{time_sheet_id}:clientes:{client}"]
+        enqueue_rows(time_sheet_id, "clientes", [[client]], keys=client_keys)
+        keys += client_keys
+    return keys
+
+
+def _rows_written(keys, last_attempt):
+    # El paso termina cuando la cola confirma todas sus filas en Sheets, no cuando se encolan
+    statuses = row_status(keys)
+    failed = [key for key, status in statuses.items() if status == "failed"]
+    if failed:
+        if not last_attempt:
+            # La cola las descartó: vuelven a encolarse para el próximo intento del trabajo
+            retry_rows(failed)
+        raise RuntimeError(f"La cola de escritura descartó las filas: {', '.join(failed)}")
+    return all(status == "flushed" for status in statuses.values())
+
+
+def _upload(drive_service, folder_id, job_dir, progress):
+    file_paths = spool_files(job_dir)
+    if file_paths:
+        progress.update({file_path: 0.0 for file_path in file_paths})
+
+        def on_progress(file_path, value):
+            progress[file_path] = value
+
+        # Los archivos que ya llegaron en un intento anterior se detectan por checksum y no se suben de nuevo
+        results = upload_files(drive_service, folder_id, file_paths, on_progress)
+        errors = [result for result in results.values() if isinstance(result, Exception)]
+        if errors:
+            raise errors[0]
+    clear_spool(job_dir)
+
+
+def _run_job(request_id, state):
+    row = _connection().execute(
+        "SELECT payload_json, job_dir, step, folder_id, folder_link, attempts FROM finalize_jobs WHERE request_id = ?",
+        (request_id,)
+    ).fetchone()
+    payload_json, job_dir, step, folder_id, folder_link, attempts = row
+    payload = json.loads(payload_json)
+
+    # Pasos folder -> sheets -> drive; cada uno es idempotente y se retoma desde el último confirmado
+    try:
+        _update(request_id, status="running")
+        drive_service = get_drive_service()
+
+        if step == "folder":
+            folder_id = _ensure_folder(drive_service, request_id, PARENT_FOLDER_ID)
+            folder_link = f"https://drive.google.com/drive/folders/{folder_id}"
+            step = "sheets"
+            _update(request_id, step=step, folder_id=folder_id, folder_link=folder_link)
+
+        if step == "sheets":
+            keys = _save_rows(request_id, payload, folder_link)
+            if not _rows_written(keys, last_attempt=attempts + 1 >= MAX_ATTEMPTS):
+                # Sin gastar un intento: se vuelve a mirar la cola en el próximo ciclo
+                _update(request_id, status="pending", next_attempt_at=time.time() + POLL_INTERVAL)
+                return
+            step = "drive"
+            _update(request_id, step=step)
+
+        if step == "drive":
+            _upload(drive_service, folder_id, job_dir, state["progress"].setdefault(request_id, {}))
+            _update(request_id, step="done", status="done", last_error=None)
+
+    except CircuitOpenError as e:
+        # Con el circuito abierto no se gasta un intento: se espera a que Drive/Sheets se recuperen
+        _update(request_id, status="pending", last_error=str(e), next_attempt_at=time.time() + RESET_TIMEOUT)
+    except Exception as e:
+        attempts += 1
+        delay = random.uniform(0, min(MAX_RETRY_DELAY, RETRY_DELAY * 2 ** attempts))
+        _update(request_id, status="failed" if attempts >= MAX_ATTEMPTS else "pending", attempts=attempts,
+                last_error=f"Paso {step}: {e}", next_attempt_at=time.time() + delay)
+    finally:
+        with state["lock"]:
+            state["running"].discard(request_id)
+        state["progress"].pop(request_id, None)
+        state["event"].set()
+
+
+def _due_jobs():
+    return [row[0] for row in _connection().execute(
+        "SELECT request_id FROM finalize_jobs WHERE status = 'pending' AND next_attempt_at <= ? ORDER BY created_at",
+        (time.time(),)
+    ).fetchall()]
+
+
+def _run(state):
+    with ThreadPoolExecutor(max_workers=JOB_WORKERS, thread_name_prefix="finalize-job") as executor:
+        while True:
+            state["event"].wait(POLL_INTERVAL)
+            state["event"].clear()
+            try:
+                for request_id in _due_jobs():
+                    with state["lock"]:
+                        if request_id in state["running"]:
+                            continue
+                        state["running"].add(request_id)
+                    executor.submit(_run_job, request_id, state)
+            except Exception as e:
+                logger.exception("Error en la cola de finalización de solicitudes: %s", e)
+
+
+@st.cache_resource
+def get_finalize_worker():
+    # Los trabajos que quedaron 'submitting' o 'running' al caer el proceso se retoman desde su último paso
+    with _connection() as conn:
+        conn.execute("UPDATE finalize_jobs SET status = 'pending' WHERE status IN ('submitting', 'running')")
+
+    state = {"event": threading.Event(), "lock": threading.Lock(), "running": set(), "progress": {}}
+    state["thread"] = threading.Thread(target=_run, args=(state,), daemon=True, name="finalize-jobs")
+    state["thread"].start()
+    return state
@@ -0,0 +1,50 @@
+from local_store import get_connection
+
+REQUEST_COUNTER = "request_id"
+
+
+class CounterNotReconciledError(RuntimeError):
+    pass
+
+
+def _marker(name):
+    # Fila aparte en counters: existe desde la primera vez que el contador se alineó con la fuente
+    return f"{name}:reconciled"
+
+_SCHEMA = "CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER NOT NULL)"
+
+
+def _connection():
+    conn = get_connection()
+    conn.execute(_SCHEMA)
+    return conn
+
+
+def reconcile_counter(name, floor):
+    # Nunca baja el contador: solo lo alinea si la hoja va más adelante
+    conn = _connection()
+    with conn:
+        conn.execute(
+            "INSERT INTO counters (name, value) VALUES (?, ?) "
+            "ON CONFLICT(name) DO UPDATE SET value = MAX(value, excluded.value)",
+            (name, floor)
+        )
+        conn.execute("INSERT OR IGNORE INTO counters (name, value) VALUES (?, 1)", (_marker(name),))
+
+
+def next_value(name):
+    # Una base nueva o perdida empezaría de nuevo en 1 y repetiría valores ya usados: hasta la primera
+    # reconciliación exitosa no se entrega ninguno
+    conn = _connection()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        if conn.execute("SELECT 1 FROM counters WHERE name = ?", (_marker(name),)).fetchone() is None:
+            raise CounterNotReconciledError(f"El contador {name} aún no se ha reconciliado con la fuente")
+        conn.execute("INSERT OR IGNORE INTO counters (name, value) VALUES (?, 0)", (name,))
+        conn.execute("UPDATE counters SET value = value + 1 WHERE name = ?", (name,))
+        value = conn.execute("SELECT value FROM counters WHERE name = ?", (name,)).fetchone()[0]
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    return value
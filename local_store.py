@@ -0,0 +1,19 @@
+import os
+import sqlite3
+import threading
+
+STATE_DB = os.path.join(".cache", "state.db")
+
+_local = threading.local()
+
+
+def get_connection():
+    # sqlite3 no comparte conexiones entre hilos: una por hilo
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        os.makedirs(os.path.dirname(STATE_DB), exist_ok=True)
+        conn = sqlite3.connect(STATE_DB, timeout=30, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        _local.conn = conn
+    return conn
@@ -0,0 +1,91 @@
+import os
+import pickle
+import tempfile
+
+import pandas as pd
+import streamlit as st
+
+from search import build_search_index
+
+INDEX_DIR = os.path.join(".cache", "indexes")
+INDEX_VERSION = 3
+
+PORTS_FILE = "data/output_port_world.csv"
+CITIES_FILE = "data/cities_world.csv"
+
+
+def build_location_index(df, country_col, name_col):
+    df = df.dropna(subset=[country_col])
+    countries = df[country_col].astype(str).unique().tolist()
+
+    ports_by_country = {}
+    for country, names in df.dropna(subset=[name_col]).groupby(df[country_col].astype(str), sort=False)[name_col]:
+        ports_by_country[country] = names.astype(str).unique().tolist()
+
+    # Las opciones ya incluyen la opción vacía de los selectbox: la posición es el índice del widget.
+    # Los índices de búsqueda se arman aquí, no al consultar: el índice se comparte entre sesiones
+    # (st.cache_resource) y no se modifica después de construido
+    return {
+        "version": INDEX_VERSION,
+        "country_options": [""] + countries,
+        "country_positions": {country: i + 1 for i, country in enumerate(countries)},
+        "port_options": {country: [""] + ports for country, ports in ports_by_country.items()},
+        "search": {country: build_search_index(ports) for country, ports in ports_by_country.items()},
+    }
+
+
+def _index_path(source, country_col, name_col):
+    stat = os.stat(source)
+    base = os.path.splitext(os.path.basename(source))[0]
+    columns = "_".join(str(col).replace(" ", "-") for col in (country_col, name_col))
+    return os.path.join(INDEX_DIR, f"{base}.{columns}.{int(stat.st_mtime)}.{stat.st_size}.v{INDEX_VERSION}.pkl")
+
+
+@st.cache_resource
+def load_location_index(source, country_col, name_col):
+    index_path = _index_path(source, country_col, name_col)
+    if os.path.exists(index_path):
+        try:
+            with open(index_path, "rb") as file:
+                return pickle.load(file)
+        except (OSError, pickle.UnpicklingError, EOFError):
+            pass
+
+    index = build_location_index(pd.read_csv(source), country_col, name_col)
+
+    # Archivo temporal propio por escritor: varios workers pueden construir el índice a la vez
+    os.makedirs(INDEX_DIR, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=INDEX_DIR, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as file:
+            pickle.dump(index, file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, index_path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    return index
+
+
+def load_ports_index():
+    return load_location_index(PORTS_FILE, "country", "port name")
+
+
+def load_cities_index():
+    return load_location_index(CITIES_FILE, "Country", "City")
+
+
+def country_options(index):
+    return index["country_options"]
+
+
+def country_position(index, country):
+    return index["country_positions"].get(country, 0)
+
+
+def location_options(index, country):
+    return index["port_options"].get(country, [""])
+
+
+def location_search_index(index, country):
+    return index["search"].get(country) or build_search_index([])
+
@@ -0,0 +1,76 @@
+import math
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+from st_aggrid import AgGrid, GridOptionsBuilder
+
+PAGE_SIZE = 20
+
+
+def _sort_key(values):
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        values = values.astype(object)
+    if pd.api.types.is_numeric_dtype(values) or pd.api.types.is_datetime64_any_dtype(values):
+        return values
+    # Las hojas mezclan números y texto en una misma columna: se ordena como número si todo lo no vacío lo es
+    numeric = pd.to_numeric(values, errors="coerce")
+    filled = values.astype(str).str.strip().ne("") & values.notna()
+    if numeric[filled].notna().all():
+        return numeric
+    return values.astype(str).str.casefold()
+
+
+@st.cache_resource(max_entries=64)
+def sort_order(version, column, ascending, _df):
+    # Un argsort por versión de datos y columna; las páginas solo lo recorren
+    if column is None or column not in _df.columns:
+        return np.arange(len(_df))
+    key = _sort_key(_df[column].reset_index(drop=True))
+    return key.sort_values(ascending=ascending, kind="stable", na_position="last").index.to_numpy()
+
+
+def page_positions(order, mask, page, page_size=PAGE_SIZE):
+    # Posiciones (en el orden pedido) de las filas que pasan el filtro, solo de la página visible
+    selected = order[np.asarray(mask, dtype=bool)[order]]
+    start = (page - 1) * page_size
+    return selected[start:start + page_size], len(selected)
+
+
+def paged_grid(df, mask, version, key, visible_columns=None, page_size=PAGE_SIZE):
+    # Ordenamiento, filtro y paginación en el servidor: al navegador solo viaja la página visible
+    columns = [col for col in (visible_columns or df.columns) if col in df.columns]
+
+    col1, col2, col3 = st.columns([2, 1, 1])
+    with col1:
+        sort_column = st.selectbox("Sort by", [None] + columns, key=f"{key}_sort",
+                                   format_func=lambda col: "—" if col is None else col)
+    with col2:
+        descending = st.toggle("Descending", key=f"{key}_desc")
+
+    order = sort_order(version, sort_column, not descending, df)
+    total = int(np.count_nonzero(mask))
+    pages = max(1, math.ceil(total / page_size))
+
+    page_key = f"{key}_page"
+    if st.session_state.get(page_key, 1) > pages:
+        st.session_state[page_key] = pages
+    with col3:
+        page = st.number_input("Page", min_value=1, max_value=pages, step=1, key=page_key)
+
+    positions, total = page_positions(order, mask, page, page_size)
+    page_df = df.iloc[positions]
+
+    first = (page - 1) * page_size + 1 if total else 0
+    st.caption(f"Showing {first}–{first + len(page_df) - 1 if total else 0} of {total}")
+
+    gb = GridOptionsBuilder.from_dataframe(page_df)
+    for col in page_df.columns:
+        gb.configure_column(col, hide=col not in columns, sortable=False)
+    gb.configure_selection("single", use_checkbox=True)
+    gb.configure_grid_options(domLayout='autoHeight')
+
+    grid_response = AgGrid(page_df, gridOptions=gb.build(),
+                           enable_enterprise_modules=False,
+                           fit_columns_on_grid_load=True)
+    return grid_response.get("selected_rows")
@@ -0,0 +1,82 @@
+import pandas as pd
+
+COST_COLUMNS = [
+    "ORIGEN", "FLETE", "DESTINO", "TOTAL FLETE Y ORIGEN", "HBL", "Switch",
+    "TOTAL FLETE, ORIGEN Y DESTINO", "TOTAL FLETE, ORIGEN Y SWITCH O HBL"
+]
+CONTRACT_KEYS = ["Línea", "No CONTRATO"]
+CONTAINER_COLUMN = "TIPO CONT"
+INCLUDED = "INCLUIDO"
+
+
+def parse_prices(values):
+    # "$1.234,56" -> 1234.56 ; "INCLUIDO" -> máscara aparte ; lo demás -> NaN
+    text = values.astype("string").str.strip()
+    included = text.str.upper().eq(INCLUDED).fillna(False).astype(bool)
+    cleaned = (
+        text.str.replace("$", "", regex=False)
+        .str.replace(".", "", regex=False)
+        .str.replace(",", ".", regex=False)
+    )
+    amounts = pd.to_numeric(cleaned, errors="coerce").astype(float)
+    return amounts.mask(included), included
+
+
+def price_frame(df):
+    priced = {}
+    for col in COST_COLUMNS:
+        if col in df.columns:
+            priced[f"{col}__amount"], priced[f"{col}__included"] = parse_prices(df[col])
+    return df.assign(**priced)
+
+
+def _concept_label(col):
+    return col.capitalize()
+
+
+def build_cost_tables(df):
+    # Una sola agregación para todos los contratos: {(línea, contrato): tablas por concepto x contenedor}
+    columns = [col for col in COST_COLUMNS if col in df.columns]
+    if df.empty or not columns:
+        return {}
+
+    if f"{columns[0]}__amount" not in df.columns:
+        df = price_frame(df)
+
+    df = df.dropna(subset=columns, how="all")
+    value_columns = columns + [f"{col}__amount" for col in columns] + [f"{col}__included" for col in columns]
+    grouped = df.groupby(CONTRACT_KEYS + [CONTAINER_COLUMN], sort=False)[value_columns].first()
+
+    labels = [_concept_label(col) for col in columns]
+    tables = {}
+    for key, rows in grouped.groupby(level=[0, 1], sort=False):
+        rows = rows.droplevel([0, 1])
+
+        display = rows[columns].T.set_axis(labels)
+        amounts = rows[[f"{col}__amount" for col in columns]].T.set_axis(labels)
+        included = rows[[f"{col}__included" for col in columns]].T.set_axis(labels).fillna(False).astype(bool)
+
+        display = display.fillna("").astype(str)
+        keep = display.apply(lambda col: col.str.strip()).ne("").any(axis=1)
+        display, amounts, included = display[keep], amounts[keep], included[keep]
+
+        tables[key] = {
+            "display": display.rename_axis("CONCEPTO").rename_axis(None, axis=1),
+            "amounts": amounts.rename_axis(None, axis=1),
+            "included": included.rename_axis(None, axis=1),
+            "cargo_types": display.columns.tolist(),
+        }
+    return tables
+
+
+def cost_of(table, concept, cargo_type):
+    # Devuelve (costo, texto a mostrar) como lo espera el formulario de cotización
+    amounts, included = table["amounts"], table["included"]
+    if concept not in amounts.index or cargo_type not in amounts.columns:
+        return 0.0, "Not Available"
+    if included.at[concept, cargo_type]:
+        return 0.0, INCLUDED
+    amount = amounts.at[concept, cargo_type]
+    if pd.isna(amount):
+        return 0.0, "Not Available"
+    return float(amount), f"${float(amount):.2f}"
@@ -0,0 +1,58 @@
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+from sheet_sync import derived_table
+
+# En cada línea de ROUTES_INFO el primer "(...)" es el origen y el segundo el destino
+ROUTE_PATTERN = r"\(([^)]*)\)(?:[^(]*\(([^)]*)\))?"
+ROUTE_COLUMNS = ["origen", "destino"]
+
+
+def parse_routes(df):
+    # Una fila por ruta: "row" es la etiqueta de la fila en la hoja
+    if df.empty or "ROUTES_INFO" not in df.columns:
+        routes = pd.DataFrame({"row": pd.Series(dtype="int64")})
+    else:
+        lines = df["ROUTES_INFO"].astype(str).str.split(r"\r?\n|\r", regex=True).explode().dropna()
+        routes = lines.str.extract(ROUTE_PATTERN).set_axis(ROUTE_COLUMNS, axis=1)
+        routes = routes.dropna(subset=["origen"]).rename_axis("row").reset_index()
+    for col in ROUTE_COLUMNS:
+        routes[col] = routes.get(col, pd.Series(dtype=object)).astype("category")
+    return routes
+
+
+def combine_routes(old, new):
+    combined = pd.concat([old[["row"]], new[["row"]]], ignore_index=True)
+    for col in ROUTE_COLUMNS:
+        combined[col] = union_categoricals([old[col], new[col]], ignore_order=True)
+    return combined
+
+
+def transport_combo(df):
+    if df.empty or "TRANSPORT_TYPE" not in df.columns:
+        return pd.Series(dtype="category", index=df.index)
+    transport = df["TRANSPORT_TYPE"].astype(str)
+    modality = df["MODALITY"].astype(str) if "MODALITY" in df.columns else ""
+    combo = np.where(transport == "Maritime", transport + " - " + modality, transport)
+    return pd.Series(combo, index=df.index).where(df["TRANSPORT_TYPE"].notna()).astype("category")
+
+
+def combine_combo(old, new):
+    return pd.Series(union_categoricals([old, new], ignore_order=True), index=old.index.append(new.index))
+
+
+def load_request_routes(sheet_id, worksheet_name):
+    return derived_table(sheet_id, worksheet_name, "routes", parse_routes, combine_routes)
+
+
+def load_transport_combo(sheet_id, worksheet_name):
+    return derived_table(sheet_id, worksheet_name, "transport_combo", transport_combo, combine_combo)
+
+
+def route_options(routes, column):
+    return sorted(routes[column].dropna().unique())
+
+
+def rows_with_route(routes, column, selected):
+    return routes.loc[routes[column].isin(selected), "row"].unique()
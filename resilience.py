@@ -0,0 +1,169 @@
+import random
+import socket
+import threading
+import time
+
+import gspread
+import requests
+from googleapiclient.errors import HttpError
+
+MAX_ATTEMPTS = 5
+BASE_DELAY = 0.5
+MAX_DELAY = 30
+FAILURE_THRESHOLD = 5
+RESET_TIMEOUT = 60
+
+RETRYABLE_STATUS = {408, 429, 500, 502, 503, 504}
+# Drive informa los límites de cuota como 403 con uno de estos motivos
+RATE_LIMIT_REASONS = {"rateLimitExceeded", "userRateLimitExceeded", "RATE_LIMIT_EXCEEDED"}
+NETWORK_ERRORS = (ConnectionError, TimeoutError, socket.timeout, requests.exceptions.ConnectionError,
+                  requests.exceptions.Timeout)
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+_lock = threading.Lock()
+_breakers = {}
+_metrics = {}
+
+
+def _new_metrics():
+    return {"calls": 0, "successes": 0, "failures": 0, "retries": 0, "short_circuits": 0, "total_time": 0.0}
+
+
+def _record(endpoint, **increments):
+    with _lock:
+        metrics = _metrics.setdefault(endpoint, _new_metrics())
+        for key, value in increments.items():
+            metrics[key] += value
+
+
+def get_metrics():
+    with _lock:
+        metrics = {endpoint: dict(values) for endpoint, values in _metrics.items()}
+        for endpoint, breaker in _breakers.items():
+            metrics.setdefault(endpoint, _new_metrics())["circuit"] = breaker["state"]
+    return metrics
+
+
+def _parse_retry_after(value):
+    if value is None:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+def _reasons(error):
+    if isinstance(error, gspread.exceptions.APIError):
+        details = error.error.get("errors") or error.error.get("details") or []
+    else:
+        details = error.error_details if isinstance(error.error_details, list) else []
+    return {detail.get("reason") for detail in details if isinstance(detail, dict)}
+
+
+def _throttled(error):
+    # Un 429 o un 403 por cuota se rechaza antes de ejecutarse: es seguro repetir incluso una
+    # llamada no idempotente
+    if isinstance(error, gspread.exceptions.APIError):
+        status = error.response.status_code
+    elif isinstance(error, HttpError):
+        status = error.resp.status
+    else:
+        return False
+    return status == 429 or (status == 403 and bool(_reasons(error) & RATE_LIMIT_REASONS))
+
+
+def _classify(error):
+    # Devuelve (reintentable, segundos de Retry-After)
+    if isinstance(error, gspread.exceptions.APIError):
+        response = error.response
+        retryable = response.status_code in RETRYABLE_STATUS or _throttled(error)
+        return retryable, _parse_retry_after(response.headers.get("Retry-After"))
+    if isinstance(error, HttpError):
+        retryable = error.resp.status in RETRYABLE_STATUS or _throttled(error)
+        return retryable, _parse_retry_after(error.resp.get("retry-after"))
+    if isinstance(error, NETWORK_ERRORS):
+        return True, None
+    return False, None
+
+
+def _before_call(endpoint):
+    with _lock:
+        breaker = _breakers.setdefault(endpoint, {"state": "closed", "failures": 0, "opened_at": 0.0})
+        if breaker["state"] == "half_open":
+            return False
+        if breaker["state"] == "open":
+            if time.monotonic() - breaker["opened_at"] < RESET_TIMEOUT:
+                return False
+            # Deja pasar una llamada de prueba
+            breaker["state"] = "half_open"
+        return True
+
+
+def _after_call(endpoint, success):
+    with _lock:
+        breaker = _breakers[endpoint]
+        if success:
+            breaker.update(state="closed", failures=0)
+            return
+        breaker["failures"] += 1
+        if breaker["state"] == "half_open" or breaker["failures"] >= FAILURE_THRESHOLD:
+            breaker.update(state="open", opened_at=time.monotonic())
+
+
+def _release_probe(endpoint):
+    # La llamada de prueba no terminó (KeyboardInterrupt, StopException/RerunException de Streamlit):
+    # el circuito vuelve a abierto y la siguiente llamada hace la prueba
+    with _lock:
+        breaker = _breakers[endpoint]
+        if breaker["state"] == "half_open":
+            breaker["state"] = "open"
+
+
+def resilient_call(endpoint, fn, *args, max_attempts=MAX_ATTEMPTS, idempotent=True, **kwargs):
+    # idempotent=False (crear archivos o carpetas, agregar filas): tras un 5xx o un timeout la llamada
+    # pudo haberse aplicado, así que no se repite; el que llama decide cómo verificarlo
+    for attempt in range(max_attempts):
+        if not _before_call(endpoint):
+            _record(endpoint, short_circuits=1)
+            raise CircuitOpenError(f"Google API '{endpoint}' no está disponible temporalmente. Intenta más tarde.")
+
+        started = time.monotonic()
+        settled = False
+        try:
+            result = fn(*args, **kwargs)
+            settled = True
+        except Exception as e:
+            settled = True
+            retryable, retry_after = _classify(e)
+            _record(endpoint, calls=1, total_time=time.monotonic() - started)
+            if not retryable:
+                # El servicio respondió: un 404 o un 403 que no es de cuota no indica caída
+                _after_call(endpoint, success=True)
+                _record(endpoint, failures=1)
+                raise
+
+            _after_call(endpoint, success=False)
+            _record(endpoint, failures=1)
+            if attempt + 1 >= max_attempts or not (idempotent or _throttled(e)):
+                raise
+
+            delay = random.uniform(0, min(MAX_DELAY, BASE_DELAY * 2 ** attempt))
+            if retry_after is not None:
+                if retry_after > MAX_DELAY:
+                    raise
+                delay = max(delay, retry_after)
+            _record(endpoint, retries=1)
+            time.sleep(delay)
+            continue
+        finally:
+            if not settled:
+                _release_probe(endpoint)
+
+        _after_call(endpoint, success=True)
+        _record(endpoint, calls=1, successes=1, total_time=time.monotonic() - started)
+        return result
@@ -0,0 +1,31 @@
+import re
+
+from schema import concat_typed
+from sheet_sync import derived_table
+
+
+def _append(old, new):
+    # Las vistas conservan la etiqueta de fila de la hoja (la usan los índices de rutas y etiquetas)
+    return concat_typed(old, new, ignore_index=False)
+
+
+def owner_view(sheet_id, worksheet_name, column, owner):
+    # Filas cuyo valor en column es exactamente owner (p. ej. COMMERCIAL == nombre del comercial)
+    def build(df):
+        if column not in df.columns:
+            return df.iloc[0:0]
+        return df[df[column] == owner]
+
+    return derived_table(sheet_id, worksheet_name, f"view:{column}={owner}", build, _append)
+
+
+def member_view(sheet_id, worksheet_name, column, member):
+    # Filas donde member aparece en la lista separada por comas de column (p. ej. ASSIGNED_TO)
+    pattern = rf"(?:^|,)\s*{re.escape(member)}\s*(?:,|$)"
+
+    def build(df):
+        if column not in df.columns:
+            return df.iloc[0:0]
+        return df[df[column].astype(str).str.contains(pattern, regex=True, na=False)]
+
+    return derived_table(sheet_id, worksheet_name, f"view:{column}~{member}", build, _append)
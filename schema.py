@@ -0,0 +1,103 @@
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+CATEGORY = "category"
+DATETIME = "datetime"
+NUMBER = "number"
+MONEY = "money"
+TEXT = "text"
+
+_REQUEST_SCHEMA = {
+    "TIME": DATETIME,
+    "DEADLINE": DATETIME,
+    "COMMERCIAL": CATEGORY,
+    "SERVICE": CATEGORY,
+    "CLIENT": CATEGORY,
+    "INCOTERM": CATEGORY,
+    "TRANSPORT_TYPE": CATEGORY,
+    "MODALITY": CATEGORY,
+    "COUNTRY_ORIGIN": CATEGORY,
+    "COUNTRY_DESTINATION": CATEGORY,
+    "TYPE_CONTAINER": CATEGORY,
+    "GROUND_SERVICE": CATEGORY,
+    "IMO": CATEGORY,
+    "STACKABLE": CATEGORY,
+    "LCL_FCL_MODE": CATEGORY,
+    "STATUS": CATEGORY,
+    "ASSIGNED_TO": CATEGORY,
+}
+
+# Tipos por hoja; las columnas que no aparecen quedan como llegan de la hoja
+SCHEMAS = {
+    "All Quotes": _REQUEST_SCHEMA,
+    "Ground Quotations": _REQUEST_SCHEMA,
+    "CONTRATOS": {
+        "Time": DATETIME,
+        "Commercial": CATEGORY,
+        "Cliente": CATEGORY,
+        "Incoterm": CATEGORY,
+        "POL": CATEGORY,
+        "POD": CATEGORY,
+        "Commodity": CATEGORY,
+        "Contrato ID": CATEGORY,
+        "Cargo Types": TEXT,
+        "Cargo Value": NUMBER,
+        "Surcharges (Costos)": TEXT,
+        "Surcharges (Ventas)": TEXT,
+        "Additional Surcharges (Costos)": TEXT,
+        "Additional Surcharges (Ventas)": TEXT,
+        "Total Cost": MONEY,
+        "Total Sale": MONEY,
+        "Total Profit": MONEY,
+    },
+}
+
+
+def clean_text(value):
+    if isinstance(value, str):
+        value = value.replace("\n", " ")
+        value = " ".join(value.split())
+    return value
+
+
+def _blank_to_na(values):
+    return values.where(values.astype(str).str.strip().ne(""))
+
+
+def _convert(values, kind):
+    if kind == DATETIME:
+        return pd.to_datetime(_blank_to_na(values), format="mixed", errors="coerce")
+    if kind == NUMBER:
+        return pd.to_numeric(_blank_to_na(values), errors="coerce")
+    if kind == MONEY:
+        cleaned = values.astype(str).str.replace("$", "", regex=False).str.replace(",", "", regex=False)
+        return pd.to_numeric(_blank_to_na(cleaned), errors="coerce")
+    if kind == CATEGORY:
+        # Vacíos y NaN quedan como faltantes, no como categorías "" o "nan" en los filtros
+        stripped = values.astype(str).str.strip()
+        return stripped.where(values.notna() & stripped.ne("")).astype("category")
+    if kind == TEXT:
+        return values.map(clean_text)
+    return values
+
+
+def apply_schema(worksheet_name, df):
+    schema = SCHEMAS.get(worksheet_name)
+    if not schema or df.empty:
+        return df
+    return df.assign(**{col: _convert(df[col], kind) for col, kind in schema.items() if col in df.columns})
+
+
+def concat_typed(old, new, ignore_index=True):
+    # pd.concat convierte a object las categóricas con categorías distintas: se unen antes
+    combined = pd.concat([old, new], ignore_index=ignore_index)
+    for col in old.columns.intersection(new.columns):
+        if isinstance(old[col].dtype, pd.CategoricalDtype) and isinstance(new[col].dtype, pd.CategoricalDtype):
+            combined[col] = pd.Series(
+                union_categoricals([old[col], new[col]], ignore_order=True), index=combined.index
+            )
+    return combined
+
+
+def memory_usage(df):
+    return int(df.memory_usage(deep=True).sum())
@@ -0,0 +1,88 @@
+import heapq
+import unicodedata
+from array import array
+from collections import Counter
+
+import streamlit as st
+
+TOP_K = 20
+MIN_SCORE = 0.25
+
+
+def fold(text):
+    # "Bonaventura" y "Buenaventurá" se comparan sin tildes ni mayúsculas
+    text = unicodedata.normalize("NFKD", str(text))
+    text = "".join(ch for ch in text if not unicodedata.combining(ch))
+    return " ".join(text.casefold().split())
+
+
+def trigrams(folded):
+    padded = f"  {folded} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def build_search_index(items):
+    items = list(dict.fromkeys(str(item) for item in items if str(item).strip()))
+    folded = [fold(item) for item in items]
+    postings = {}
+    sizes = array("I")
+    for item_id, text in enumerate(folded):
+        grams = trigrams(text)
+        sizes.append(len(grams))
+        for gram in grams:
+            postings.setdefault(gram, array("I")).append(item_id)
+    return {"items": items, "folded": folded, "postings": postings, "sizes": sizes}
+
+
+def search(index, query, k=TOP_K):
+    query = fold(query)
+    if not query:
+        return index["items"][:k]
+
+    grams = trigrams(query)
+    shared = Counter()
+    for gram in grams:
+        posting = index["postings"].get(gram)
+        if posting:
+            shared.update(posting)
+
+    scored = []
+    for item_id, common in shared.items():
+        score = common / (len(grams) + index["sizes"][item_id] - common)
+        text = index["folded"][item_id]
+        # Coincidencias exactas de prefijo o subcadena van primero
+        if text.startswith(query):
+            score += 1.0
+        elif query in text:
+            score += 0.5
+        if score >= MIN_SCORE:
+            scored.append((score, -item_id))
+
+    return [index["items"][-item_id] for _, item_id in heapq.nlargest(k, scored)]
+
+
+@st.cache_resource(max_entries=500)
+def cached_search_index(items):
+    return build_search_index(items)
+
+
+def search_selectbox(label, options, key, value="", fixed=(), limit=TOP_K, index=None):
+    # Solo se envían al navegador las mejores coincidencias, no la lista completa
+    fixed = list(fixed)
+    options = [option for option in options if option not in fixed]
+    # La lista de opciones cambia con la búsqueda y Streamlit trata el selectbox como uno nuevo:
+    # la selección actual se conserva entre las opciones y se pasa como posición inicial
+    current = st.session_state.get(key, value)
+    if len(options) <= limit:
+        choices = fixed + options
+    else:
+        query = st.text_input(f"Search {label.rstrip('*')}", key=f"{key}_search", placeholder="Type to search...")
+        if index is None:
+            index = cached_search_index(tuple(options))
+        matches = search(index, query, limit)
+        if current and current not in fixed and current not in matches and current in options:
+            matches = [current] + matches
+        choices = fixed + matches
+
+    position = choices.index(current) if current in choices else 0
+    return st.selectbox(label, choices, index=position, key=key)
@@ -0,0 +1,222 @@
+import logging
+import sys
+import threading
+import time
+
+import pandas as pd
+import streamlit as st
+from gspread.utils import numericise_all
+
+from resilience import resilient_call
+from schema import apply_schema, concat_typed, memory_usage
+from write_queue import add_flush_hook
+
+SYNC_INTERVAL = 300
+FULL_SYNC_INTERVAL = 6 * 3600
+# Tope de RAM para las tablas sincronizadas y sus vistas derivadas de todo el proceso
+MEMORY_BUDGET = 512 * 1024 ** 2
+
+logger = logging.getLogger(__name__)
+
+
+# Una sola tabla por hoja compartida entre todas las sesiones del proceso. Es un dict de módulo
+# (no st.cache_resource) porque _mark_stale lo recorre desde el hilo de la cola de escritura.
+_registry = {}
+_registry_lock = threading.Lock()
+
+
+def _get_table(sheet_id, worksheet_name):
+    with _registry_lock:
+        table = _registry.get((sheet_id, worksheet_name))
+        if table is None:
+            table = _registry[(sheet_id, worksheet_name)] = {
+                "lock": threading.Lock(),
+                "header": [],
+                "next_row": 2,
+                "df": pd.DataFrame(),
+                "synced_at": 0.0,
+                "full_synced_at": 0.0,
+                "version": 0,
+                "generation": 0,
+                "derived": {},
+                "memory": 0,
+            }
+        return table
+
+
+def _to_records(header, rows):
+    width = len(header)
+    records = []
+    for row in rows:
+        row = list(row[:width]) + [""] * (width - len(row))
+        records.append(numericise_all(row, empty2zero=False, default_blank=""))
+    return pd.DataFrame(records, columns=header)
+
+
+def _fetch_new_rows(client, sheet_id, worksheet_name, next_row):
+    spreadsheet = resilient_call("sheets", client.open_by_key, sheet_id)
+    response = resilient_call("sheets", spreadsheet.values_batch_get, [
+        f"'{worksheet_name}'!1:1",
+        f"'{worksheet_name}'!A{next_row}:ZZZ",
+    ])
+    header_range, rows_range = response.get("valueRanges", [{}, {}])
+    header = (header_range.get("values") or [[]])[0]
+    rows = rows_range.get("values", [])
+    return header, rows
+
+
+def _sync(table, client, sheet_id, worksheet_name, full):
+    next_row = 2 if full else table["next_row"]
+    header, rows = _fetch_new_rows(client, sheet_id, worksheet_name, next_row)
+
+    if not full and header != table["header"]:
+        # Cambió la estructura de la hoja: se recarga completa
+        next_row = 2
+        header, rows = _fetch_new_rows(client, sheet_id, worksheet_name, next_row)
+        full = True
+
+    if not header:
+        table.update(header=[], next_row=2, df=pd.DataFrame(), version=table["version"] + 1)
+        table["generation"] += 1
+        return
+
+    new_df = apply_schema(worksheet_name, _to_records(header, rows))
+    if full or table["df"].empty:
+        # Las tablas derivadas solo se extienden mientras la hoja crezca por el final
+        table["generation"] += 1
+        df = new_df
+    elif new_df.empty:
+        df = table["df"]
+    else:
+        df = concat_typed(table["df"], new_df)
+
+    if df is not table["df"]:
+        table["version"] += 1
+    table.update(header=header, next_row=next_row + len(rows), df=df)
+    if full:
+        table["full_synced_at"] = time.time()
+
+    table["memory"] = memory_usage(df)
+
+
+def sync_worksheet(client, sheet_id, worksheet_name, force=False):
+    table = _get_table(sheet_id, worksheet_name)
+
+    with table["lock"]:
+        now = time.time()
+        # El "Refresh" explícito recarga la hoja completa: así se ven también ediciones y borrados
+        full = force or now - table["full_synced_at"] > FULL_SYNC_INTERVAL
+        if force or full or now - table["synced_at"] > SYNC_INTERVAL:
+            try:
+                _sync(table, client, sheet_id, worksheet_name, full)
+                table["synced_at"] = now
+            except Exception as e:
+                st.error(f"Error al cargar datos desde Google Sheets ({worksheet_name}): {str(e)}")
+        df = table["df"]
+
+    _enforce_budget()
+    return df
+
+
+def worksheet_version(sheet_id, worksheet_name):
+    # Cambia cada vez que la tabla sincronizada cambia; sirve de llave para cachés derivadas
+    return _get_table(sheet_id, worksheet_name)["version"]
+
+
+def derived_table(sheet_id, worksheet_name, name, build, combine=None):
+    # Resultado de build(df) calculado una vez por versión de la hoja. Si desde la última vez solo
+    # llegaron filas nuevas, build se aplica a esas filas y combine(anterior, nuevo) las agrega.
+    table = _get_table(sheet_id, worksheet_name)
+    with table["lock"]:
+        df = table["df"]
+        entry = table["derived"].get(name)
+        if entry and entry["version"] == table["version"]:
+            entry["used_at"] = time.monotonic()
+            return entry["value"]
+
+        if entry and combine and entry["generation"] == table["generation"] and entry["rows"] <= len(df):
+            value = combine(entry["value"], build(df.iloc[entry["rows"]:]))
+        else:
+            value = build(df)
+
+        table["derived"][name] = {
+            "version": table["version"],
+            "generation": table["generation"],
+            "rows": len(df),
+            "value": value,
+            "memory": _value_memory(value),
+            "used_at": time.monotonic(),
+        }
+
+    _enforce_budget()
+    return value
+
+
+def _value_memory(value):
+    # Aproximado: las vistas derivadas son DataFrames, Series o dicts/listas de ellos y de bitmaps
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        return memory_usage(value)
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(_value_memory(item) for item in value.values())
+    if isinstance(value, (list, tuple)):
+        return sys.getsizeof(value) + sum(_value_memory(item) for item in value)
+    return sys.getsizeof(value)
+
+
+def _total_memory():
+    return sum(
+        table["memory"] + sum(entry["memory"] for entry in list(table["derived"].values()))
+        for table in list(_registry.values())
+    )
+
+
+def _enforce_budget():
+    # Por encima del tope se descartan las vistas derivadas menos usadas (se recalculan al pedirlas);
+    # las tablas no se tocan porque son la fuente de todo lo demás
+    total = _total_memory()
+    if total <= MEMORY_BUDGET:
+        return
+
+    candidates = sorted(
+        ((entry["used_at"], name, table)
+         for table in list(_registry.values()) for name, entry in list(table["derived"].items())),
+        key=lambda candidate: candidate[0]
+    )
+    for _, name, table in candidates:
+        with table["lock"]:
+            entry = table["derived"].pop(name, None)
+        if entry:
+            total -= entry["memory"]
+        if total <= MEMORY_BUDGET:
+            return
+    logger.warning("Tablas en memoria: %.0f MB, por encima del presupuesto de %.0f MB aun sin vistas derivadas",
+                   total / 1024 ** 2, MEMORY_BUDGET / 1024 ** 2)
+
+
+def memory_report():
+    # Memoria por hoja sincronizada en este proceso (incluye el contenido de las columnas de texto)
+    return pd.DataFrame(
+        [
+            {"Spreadsheet": sheet_id, "Worksheet": worksheet_name, "Rows": len(table["df"]),
+             "MB": round(table["memory"] / 1024 ** 2, 2),
+             "Derived views": len(table["derived"]),
+             "Derived MB": round(sum(entry["memory"] for entry in list(table["derived"].values())) / 1024 ** 2, 2)}
+            for (sheet_id, worksheet_name), table in list(_registry.items())
+        ],
+        columns=["Spreadsheet", "Worksheet", "Rows", "MB", "Derived views", "Derived MB"]
+    )
+
+
+def memory_budget():
+    # (MB en uso, MB del presupuesto) para el panel de administración
+    return round(_total_memory() / 1024 ** 2, 2), round(MEMORY_BUDGET / 1024 ** 2, 2)
+
+
+def _mark_stale(spreadsheet_id, sheet_names):
+    # Filas nuevas escritas desde la app: la próxima lectura hace la sincronización incremental
+    for (sheet_id, worksheet_name), table in list(_registry.items()):
+        if sheet_id == spreadsheet_id and worksheet_name in sheet_names:
+            table["synced_at"] = 0.0
+
+
+add_flush_hook("sheet_sync", _mark_stale)
@@ -0,0 +1,91 @@
+import json
+import os
+import re
+import tempfile
+import time
+
+import pyarrow as pa
+import pyarrow.feather as feather
+
+from resilience import resilient_call
+
+SNAPSHOT_DIR = os.path.join(".cache", "snapshots")
+META_KEY = b"snapshot"
+
+
+def _snapshot_path(spreadsheet_id, worksheet_name):
+    safe_name = re.sub(r"[^A-Za-z0-9_-]+", "_", worksheet_name)
+    return os.path.join(SNAPSHOT_DIR, f"{spreadsheet_id}_{safe_name}.arrow")
+
+
+def get_drive_revision(drive_service, file_id):
+    # "version" cambia con cada edición del archivo, también en Google Sheets
+    response = resilient_call("drive", drive_service.files().get(
+        fileId=file_id,
+        fields="version",
+        supportsAllDrives=True
+    ).execute, max_attempts=2)
+    return str(response.get("version", ""))
+
+
+def read_snapshot(spreadsheet_id, worksheet_name):
+    data_path = _snapshot_path(spreadsheet_id, worksheet_name)
+    if not os.path.exists(data_path):
+        return None, None
+
+    try:
+        with pa.memory_map(data_path, "r") as source:
+            table = pa.ipc.open_file(source).read_all()
+        # Los metadatos viajan en el esquema del mismo archivo: datos y meta siempre son del mismo fetch
+        meta = json.loads((table.schema.metadata or {})[META_KEY])
+        df = table.to_pandas()
+        df.columns = meta.get("columns", list(df.columns))
+        return df, meta
+    except (OSError, ValueError, KeyError, pa.ArrowInvalid):
+        return None, None
+
+
+def write_snapshot(spreadsheet_id, worksheet_name, df, revision):
+    os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+    data_path = _snapshot_path(spreadsheet_id, worksheet_name)
+    meta = {
+        "spreadsheet_id": spreadsheet_id,
+        "worksheet": worksheet_name,
+        "revision": revision,
+        "fetched_at": time.time(),
+        "rows": len(df),
+        "columns": [str(col) for col in df.columns],
+    }
+
+    # Los encabezados de la hoja pueden venir vacíos o repetidos; se guardan en los metadatos
+    stored = df.reset_index(drop=True)
+    stored.columns = [f"c{i}" for i in range(stored.shape[1])]
+    table = pa.Table.from_pandas(stored, preserve_index=False)
+    table = table.replace_schema_metadata({**(table.schema.metadata or {}), META_KEY: json.dumps(meta)})
+
+    # Archivo temporal propio en el mismo directorio: varios workers pueden escribir a la vez y el
+    # os.replace final es atómico. Sin compresión para que los workers puedan mapearlo en memoria.
+    fd, tmp_path = tempfile.mkstemp(dir=SNAPSHOT_DIR, suffix=".tmp")
+    os.close(fd)
+    try:
+        feather.write_feather(table, tmp_path, compression="uncompressed")
+        os.replace(tmp_path, data_path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    return meta
+
+
+def load_worksheet_snapshot(spreadsheet_id, worksheet_name, fetch, revision=None):
+    df, meta = read_snapshot(spreadsheet_id, worksheet_name)
+
+    if df is not None and revision is not None and meta.get("revision") == revision:
+        return df, meta
+
+    if df is not None and revision is None:
+        # Sin revisión disponible (p. ej. Drive caído) se sirve el último snapshot
+        return df, meta
+
+    df = fetch()
+    meta = write_snapshot(spreadsheet_id, worksheet_name, df, revision)
+    return df, meta
@@ -0,0 +1,121 @@
+import hashlib
+import logging
+import os
+import shutil
+import threading
+import time
+import uuid
+
+import streamlit as st
+
+from drive_uploads import file_md5
+
+SPOOL_ROOT = "temp_uploads"
+CHUNK_SIZE = 1024 * 1024
+SPOOL_MAX_AGE = 24 * 3600
+SPOOL_QUOTA = 2 * 1024 ** 3
+GC_INTERVAL = 600
+
+logger = logging.getLogger(__name__)
+
+
+def session_spool_dir():
+    # Cada sesión escribe en su propia carpeta: nadie sube ni borra archivos de otro usuario
+    start_spool_gc()
+    if "spool_id" not in st.session_state:
+        st.session_state["spool_id"] = uuid.uuid4().hex
+    spool_dir = os.path.join(SPOOL_ROOT, st.session_state["spool_id"])
+    os.makedirs(spool_dir, exist_ok=True)
+    os.utime(spool_dir)
+    return spool_dir
+
+
+def _upload_md5(file):
+    md5 = hashlib.md5()
+    file.seek(0)
+    for chunk in iter(lambda: file.read(CHUNK_SIZE), b""):
+        md5.update(chunk)
+    return md5.hexdigest()
+
+
+def spool_upload(file, spool_dir):
+    file_path = os.path.join(spool_dir, os.path.basename(file.name))
+    # Mismo nombre y tamaño no basta: solo se evita la copia si el contenido es idéntico
+    if (os.path.exists(file_path) and os.path.getsize(file_path) == file.size
+            and file_md5(file_path) == _upload_md5(file)):
+        return file_path
+
+    tmp_path = f"{file_path}.part"
+    file.seek(0)
+    with open(tmp_path, "wb") as out:
+        shutil.copyfileobj(file, out, CHUNK_SIZE)
+    os.replace(tmp_path, file_path)
+    return file_path
+
+
+def spool_files(spool_dir):
+    if not os.path.isdir(spool_dir):
+        return []
+    return [
+        os.path.join(spool_dir, file_name) for file_name in sorted(os.listdir(spool_dir))
+        if not file_name.endswith(".part")
+    ]
+
+
+def clear_spool(spool_dir):
+    shutil.rmtree(spool_dir, ignore_errors=True)
+
+
+def _dir_size(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        for file_name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, file_name))
+            except OSError:
+                pass
+    return total
+
+
+def collect_garbage(root=SPOOL_ROOT, max_age=SPOOL_MAX_AGE, quota=SPOOL_QUOTA):
+    if not os.path.isdir(root):
+        return
+
+    now = time.time()
+    spools = []
+    for name in os.listdir(root):
+        path = os.path.join(root, name)
+        if not os.path.isdir(path):
+            continue
+        try:
+            last_used = os.path.getmtime(path)
+        except OSError:
+            continue
+        if now - last_used > max_age:
+            shutil.rmtree(path, ignore_errors=True)
+        else:
+            spools.append((last_used, path, _dir_size(path)))
+
+    # Si se supera la cuota se eliminan primero las carpetas usadas hace más tiempo
+    total = sum(size for _, _, size in spools)
+    for _, path, size in sorted(spools):
+        if total <= quota:
+            break
+        shutil.rmtree(path, ignore_errors=True)
+        total -= size
+
+
+def _run_gc():
+    while True:
+        try:
+            collect_garbage()
+        except Exception as e:
+            logger.exception("Error limpiando %s: %s", SPOOL_ROOT, e)
+        time.sleep(GC_INTERVAL)
+
+
+@st.cache_resource
+def start_spool_gc():
+    thread = threading.Thread(target=_run_gc, daemon=True, name="spool-gc")
+    thread.start()
+    return thread
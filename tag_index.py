@@ -0,0 +1,60 @@
+import numpy as np
+
+from sheet_sync import derived_table
+
+TAG_SEPARATORS = r"[,\n;]+"
+
+
+def bitmap_from_positions(positions, rows):
+    # Bit i encendido = fila i de la hoja; se guarda como int de Python para operar con | y &
+    mask = np.zeros(rows, dtype=bool)
+    mask[np.asarray(positions, dtype=np.intp)] = True
+    return int.from_bytes(np.packbits(mask, bitorder="little").tobytes(), "little")
+
+
+def bitmap_to_mask(bitmap, rows):
+    raw = np.frombuffer(bitmap.to_bytes((rows + 7) // 8, "little"), dtype=np.uint8)
+    return np.unpackbits(raw, bitorder="little", count=rows).astype(bool)
+
+
+def build_tag_index(values):
+    # Cada celda puede traer varios valores ("FCL 20, FCL 40"): un bitmap por valor normalizado
+    rows = len(values)
+    values = values.reset_index(drop=True).dropna().astype(str)
+    tags = values.str.split(TAG_SEPARATORS, regex=True).explode().str.strip()
+    tags = tags[tags.notna() & tags.ne("")]
+    labels = tags.index.to_numpy()
+    return {
+        "rows": rows,
+        "tags": {tag: bitmap_from_positions(labels[found], rows) for tag, found in tags.groupby(tags).indices.items()},
+    }
+
+
+def combine_tag_index(old, new):
+    # Las filas nuevas van después de las anteriores: sus bits se corren old["rows"] posiciones
+    tags = dict(old["tags"])
+    for tag, bitmap in new["tags"].items():
+        tags[tag] = tags.get(tag, 0) | (bitmap << old["rows"])
+    return {"rows": old["rows"] + new["rows"], "tags": tags}
+
+
+def load_tag_index(sheet_id, worksheet_name, column):
+    def build(df):
+        if column not in df.columns:
+            return {"rows": len(df), "tags": {}}
+        return build_tag_index(df[column])
+
+    return derived_table(sheet_id, worksheet_name, f"tags:{column}", build, combine_tag_index)
+
+
+def tag_options(index, scope=None):
+    # scope: bitmap de las filas visibles para el usuario; sin scope se listan todos los valores
+    return sorted(tag for tag, bitmap in index["tags"].items() if scope is None or bitmap & scope)
+
+
+def rows_with_tags(index, selected):
+    # OR dentro de un mismo filtro
+    bitmap = 0
+    for tag in selected:
+        bitmap |= index["tags"].get(tag, 0)
+    return bitmap
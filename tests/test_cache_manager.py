@@ -0,0 +1,51 @@
+import threading
+
+import pytest
+
+import cache_manager
+import write_queue
+
+
+@pytest.fixture
+def cache(monkeypatch):
+    monkeypatch.setattr(cache_manager, "_state", {"lock": threading.RLock(), "regions": {}})
+    monkeypatch.setattr(write_queue, "_flush_hooks", {})
+    return cache_manager
+
+
+def test_write_invalidates_only_entries_reading_that_sheet(cache):
+    calls = []
+
+    @cache.cached("sheets", keys=lambda sheet_name: [("book", sheet_name)])
+    def load(sheet_name):
+        calls.append(sheet_name)
+        return sheet_name.lower()
+
+    cache.invalidate_on_write("sheets", "book", "CLIENTES")
+    load("CLIENTES")
+    load("TARIFAS")
+
+    # El hook corre en el hilo de la cola de escritura, sin ScriptRunContext
+    thread = threading.Thread(target=write_queue._run_flush_hooks, args=("book", ["CLIENTES"]))
+    thread.start()
+    thread.join()
+
+    load("CLIENTES")
+    load("TARIFAS")
+
+    assert calls == ["CLIENTES", "TARIFAS", "CLIENTES"]
+
+
+def test_entries_without_keys_are_invalidated_by_any_write(cache):
+    calls = []
+
+    @cache.cached("csv")
+    def load(name):
+        calls.append(name)
+        return name
+
+    load("a")
+    cache.invalidate("csv", ("book", "CLIENTES"))
+    load("a")
+
+    assert calls == ["a", "a"]
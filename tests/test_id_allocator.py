@@ -0,0 +1,29 @@
+import threading
+
+import pytest
+
+import id_allocator
+import local_store
+
+
+@pytest.fixture(autouse=True)
+def state_db(tmp_path, monkeypatch):
+    monkeypatch.setattr(local_store, "STATE_DB", str(tmp_path / "state.db"))
+    monkeypatch.setattr(local_store, "_local", threading.local())
+
+
+def test_new_database_refuses_ids_until_reconciled():
+    with pytest.raises(id_allocator.CounterNotReconciledError):
+        id_allocator.next_value(id_allocator.REQUEST_COUNTER)
+
+    id_allocator.reconcile_counter(id_allocator.REQUEST_COUNTER, 41)
+
+    assert id_allocator.next_value(id_allocator.REQUEST_COUNTER) == 42
+
+
+def test_reconcile_never_lowers_the_counter():
+    id_allocator.reconcile_counter(id_allocator.REQUEST_COUNTER, 10)
+    id_allocator.next_value(id_allocator.REQUEST_COUNTER)
+    id_allocator.reconcile_counter(id_allocator.REQUEST_COUNTER, 3)
+
+    assert id_allocator.next_value(id_allocator.REQUEST_COUNTER) == 12
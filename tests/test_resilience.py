@@ -0,0 +1,85 @@
+import json
+
+import pytest
+from googleapiclient.errors import HttpError
+from httplib2 import Response
+
+import resilience
+
+
+@pytest.fixture(autouse=True)
+def fresh_state(monkeypatch):
+    monkeypatch.setattr(resilience, "_breakers", {})
+    monkeypatch.setattr(resilience, "_metrics", {})
+    monkeypatch.setattr(resilience.time, "sleep", lambda seconds: None)
+
+
+def _http_error(status):
+    return HttpError(Response({"status": status}), b"")
+
+
+def _failing(status, calls):
+    def call():
+        calls.append(status)
+        raise _http_error(status)
+    return call
+
+
+def test_non_idempotent_call_is_not_repeated_after_server_error():
+    calls = []
+    with pytest.raises(HttpError):
+        resilience.resilient_call("drive", _failing(503, calls), idempotent=False)
+    assert calls == [503]
+
+
+def test_non_idempotent_call_is_repeated_when_throttled():
+    calls = []
+    with pytest.raises(HttpError):
+        resilience.resilient_call("drive", _failing(429, calls), max_attempts=3, idempotent=False)
+    assert calls == [429, 429, 429]
+
+
+def test_interrupted_probe_does_not_leave_the_circuit_half_open():
+    resilience._breakers["drive"] = {"state": "open", "failures": resilience.FAILURE_THRESHOLD, "opened_at": -1e9}
+
+    def interrupted():
+        raise KeyboardInterrupt
+
+    with pytest.raises(KeyboardInterrupt):
+        resilience.resilient_call("drive", interrupted)
+    assert resilience._breakers["drive"]["state"] == "open"
+
+    assert resilience.resilient_call("drive", lambda: "ok") == "ok"
+    assert resilience._breakers["drive"]["state"] == "closed"
+
+
+def _drive_rate_limit_error(reason):
+    content = json.dumps({"error": {"code": 403, "message": "Rate Limit Exceeded",
+                                    "errors": [{"domain": "usageLimits", "reason": reason}]}}).encode()
+    return HttpError(Response({"status": 403}), content)
+
+
+def test_drive_rate_limit_403_is_retried():
+    calls = []
+
+    def call():
+        calls.append(1)
+        if len(calls) < 3:
+            raise _drive_rate_limit_error("userRateLimitExceeded")
+        return "ok"
+
+    assert resilience.resilient_call("drive", call, idempotent=False) == "ok"
+    assert len(calls) == 3
+    assert resilience.get_metrics()["drive"]["retries"] == 2
+
+
+def test_permission_403_is_not_retried():
+    calls = []
+
+    def call():
+        calls.append(1)
+        raise _drive_rate_limit_error("insufficientFilePermissions")
+
+    with pytest.raises(HttpError):
+        resilience.resilient_call("drive", call)
+    assert calls == [1]
@@ -0,0 +1,23 @@
+import numpy as np
+import pandas as pd
+
+from schema import apply_schema, concat_typed
+
+
+def test_blank_and_missing_categories_are_missing_values():
+    df = pd.DataFrame({"CLIENT": ["Acme ", "", np.nan, "  ", "Acme"], "REQUEST_ID": ["Q1", "Q2", "Q3", "Q4", "Q5"]})
+
+    typed = apply_schema("All Quotes", df)
+
+    assert list(typed["CLIENT"].cat.categories) == ["Acme"]
+    assert typed["CLIENT"].isna().tolist() == [False, True, True, True, False]
+
+
+def test_appended_chunks_keep_the_category_dtype():
+    old = apply_schema("All Quotes", pd.DataFrame({"CLIENT": ["Acme", ""]}))
+    new = apply_schema("All Quotes", pd.DataFrame({"CLIENT": ["Globex"]}))
+
+    combined = concat_typed(old, new)
+
+    assert isinstance(combined["CLIENT"].dtype, pd.CategoricalDtype)
+    assert sorted(combined["CLIENT"].dropna()) == ["Acme", "Globex"]
@@ -0,0 +1,29 @@
+import threading
+
+import pandas as pd
+import pytest
+
+import sheet_sync
+
+
+@pytest.fixture
+def registry(monkeypatch):
+    monkeypatch.setattr(sheet_sync, "_registry", {})
+    monkeypatch.setattr(sheet_sync, "_registry_lock", threading.Lock())
+    return sheet_sync
+
+
+def test_least_recently_used_derived_views_are_dropped_over_budget(registry, monkeypatch):
+    table = registry._get_table("book", "All Quotes")
+    table["df"] = pd.DataFrame({"A": range(1000)})
+
+    registry.derived_table("book", "All Quotes", "old", lambda df: df.copy())
+    registry.derived_table("book", "All Quotes", "new", lambda df: df.copy())
+    size = table["derived"]["new"]["memory"]
+
+    monkeypatch.setattr(sheet_sync, "MEMORY_BUDGET", size + size // 2)
+    registry.derived_table("book", "All Quotes", "new", lambda df: df.copy())
+    registry._enforce_budget()
+
+    assert list(table["derived"]) == ["new"]
+    assert registry.memory_report()["Derived views"].tolist() == [1]
@@ -0,0 +1,32 @@
+import pandas as pd
+
+import snapshots
+
+
+def test_snapshot_round_trip_keeps_columns_and_meta(tmp_path, monkeypatch):
+    monkeypatch.setattr(snapshots, "SNAPSHOT_DIR", str(tmp_path))
+    df = pd.DataFrame([["a", "1"], ["b", "2"]], columns=["NAME", ""])
+
+    snapshots.write_snapshot("book", "TARIFAS SCRAP EXPO", df, "rev-1")
+    loaded, meta = snapshots.read_snapshot("book", "TARIFAS SCRAP EXPO")
+
+    assert list(loaded.columns) == ["NAME", ""]
+    assert loaded.values.tolist() == df.values.tolist()
+    assert meta["revision"] == "rev-1"
+    assert [path.name for path in tmp_path.iterdir()] == ["book_TARIFAS_SCRAP_EXPO.arrow"]
+
+
+def test_snapshot_is_served_only_for_matching_revision(tmp_path, monkeypatch):
+    monkeypatch.setattr(snapshots, "SNAPSHOT_DIR", str(tmp_path))
+    fetches = []
+
+    def fetch():
+        fetches.append(1)
+        return pd.DataFrame({"A": [str(len(fetches))]})
+
+    snapshots.load_worksheet_snapshot("book", "CONTENEDORES", fetch, "rev-1")
+    snapshots.load_worksheet_snapshot("book", "CONTENEDORES", fetch, "rev-1")
+    df, meta = snapshots.load_worksheet_snapshot("book", "CONTENEDORES", fetch, "rev-2")
+
+    assert len(fetches) == 2
+    assert df["A"].tolist() == ["2"] and meta["revision"] == "rev-2"
@@ -0,0 +1,26 @@
+import io
+
+import spool
+
+
+class Upload(io.BytesIO):
+    def __init__(self, name, content):
+        super().__init__(content)
+        self.name = name
+        self.size = len(content)
+
+
+def test_same_name_and_size_with_different_content_is_replaced(tmp_path):
+    spool.spool_upload(Upload("invoice.pdf", b"first"), str(tmp_path))
+    file_path = spool.spool_upload(Upload("invoice.pdf", b"other"), str(tmp_path))
+
+    with open(file_path, "rb") as file:
+        assert file.read() == b"other"
+
+
+def test_identical_upload_is_not_rewritten(tmp_path):
+    first = spool.spool_upload(Upload("invoice.pdf", b"first"), str(tmp_path))
+    mtime = (tmp_path / "invoice.pdf").stat().st_mtime_ns
+
+    assert spool.spool_upload(Upload("invoice.pdf", b"first"), str(tmp_path)) == first
+    assert (tmp_path / "invoice.pdf").stat().st_mtime_ns == mtime
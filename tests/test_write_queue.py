@@ -0,0 +1,171 @@
+import threading
+
+import pytest
+
+import id_allocator
+import local_store
+import write_queue
+
+SPREADSHEET_ID = "contracts-sheet"
+SHEET_NAME = "CONTRATOS"
+
+
+class _Request:
+    def __init__(self, result):
+        self._result = result
+
+    def execute(self):
+        return self._result()
+
+
+class FakeSheetsService:
+    def __init__(self, sheet_names):
+        self.sheet_ids = {name: i for i, name in enumerate(sheet_names)}
+        self.appended = {}
+
+    def spreadsheets(self):
+        return self
+
+    def values(self):
+        return self
+
+    def batchGet(self, spreadsheetId, ranges):
+        return _Request(lambda: {"valueRanges": [
+            {"values": [[row[0]] for row in self.appended.get(r.split("'")[1], [])]} for r in ranges
+        ]})
+
+    def get(self, spreadsheetId, fields):
+        return _Request(lambda: {"sheets": [
+            {"properties": {"title": title, "sheetId": sheet_id}} for title, sheet_id in self.sheet_ids.items()
+        ]})
+
+    def batchUpdate(self, spreadsheetId, body):
+        def run():
+            titles = {sheet_id: title for title, sheet_id in self.sheet_ids.items()}
+            for request in body["requests"]:
+                append = request["appendCells"]
+                rows = [[cell["userEnteredValue"]["stringValue"] for cell in row["values"]] for row in append["rows"]]
+                self.appended.setdefault(titles[append["sheetId"]], []).extend(rows)
+            return {"replies": []}
+        return _Request(run)
+
+
+@pytest.fixture
+def queue(tmp_path, monkeypatch):
+    monkeypatch.setattr(local_store, "STATE_DB", str(tmp_path / "state.db"))
+    monkeypatch.setattr(local_store, "_local", threading.local())
+    monkeypatch.setattr(write_queue, "_retry_at", {})
+    monkeypatch.setattr(write_queue, "_sheet_id_cache", {})
+    monkeypatch.setattr(write_queue, "get_write_worker", lambda: {"event": threading.Event()})
+    monkeypatch.setattr(write_queue, "resilient_call", lambda endpoint, fn, *args, **kwargs: fn(*args))
+    monkeypatch.setattr(write_queue, "_run_flush_hooks", lambda spreadsheet_id, sheet_names: None)
+    return write_queue
+
+
+def _enqueue_quotation(request_id):
+    row = [request_id, "Commercial", "2025-01-01 00:00:00", "Client"]
+    write_queue.enqueue_rows(SPREADSHEET_ID, SHEET_NAME, [row], keys=[f"{SPREADSHEET_ID}:{SHEET_NAME}:{row[0]}"])
+
+
+def test_two_quotations_in_one_session_flush_two_rows(queue):
+    # Contracts_Management asigna un ID nuevo por cotización guardada
+    id_allocator.reconcile_counter(id_allocator.REQUEST_COUNTER, 0)
+    for _ in range(2):
+        _enqueue_quotation(f"Q{id_allocator.next_value(id_allocator.REQUEST_COUNTER):04d}")
+
+    service = FakeSheetsService([SHEET_NAME])
+    queue.flush_pending(service)
+
+    assert [row[0] for row in service.appended[SHEET_NAME]] == ["Q0001", "Q0002"]
+
+
+def test_same_key_is_written_once(queue):
+    _enqueue_quotation("Q0001")
+    _enqueue_quotation("Q0001")
+
+    service = FakeSheetsService([SHEET_NAME])
+    queue.flush_pending(service)
+    queue.flush_pending(service)
+
+    assert len(service.appended[SHEET_NAME]) == 1
+
+
+def test_rows_are_reported_after_max_attempts(queue, monkeypatch, caplog):
+    _enqueue_quotation("Q0001")
+
+    class BrokenSheetsService(FakeSheetsService):
+        def batchUpdate(self, spreadsheetId, body):
+            def run():
+                raise RuntimeError("quota exceeded")
+            return _Request(run)
+
+    service = BrokenSheetsService([SHEET_NAME])
+    with caplog.at_level("ERROR", logger="write_queue"):
+        for _ in range(write_queue.MAX_ATTEMPTS):
+            monkeypatch.setattr(write_queue, "_retry_at", {})
+            queue.flush_pending(service)
+
+    assert [row["Key"] for row in queue.failed_rows()] == [f"{SPREADSHEET_ID}:{SHEET_NAME}:Q0001"]
+    assert f"{SPREADSHEET_ID}:{SHEET_NAME}:Q0001" in caplog.text
+
+
+def test_row_status_follows_rows_until_flushed(queue):
+    key = f"{SPREADSHEET_ID}:{SHEET_NAME}:Q0001"
+    _enqueue_quotation("Q0001")
+    assert queue.row_status([key, "missing"]) == {key: "pending", "missing": None}
+
+    queue.flush_pending(FakeSheetsService([SHEET_NAME]))
+    assert queue.row_status([key]) == {key: "flushed"}
+
+
+def test_failed_rows_can_be_retried(queue, monkeypatch):
+    key = f"{SPREADSHEET_ID}:{SHEET_NAME}:Q0001"
+    _enqueue_quotation("Q0001")
+
+    class BrokenSheetsService(FakeSheetsService):
+        def batchUpdate(self, spreadsheetId, body):
+            def run():
+                raise RuntimeError("quota exceeded")
+            return _Request(run)
+
+    for _ in range(write_queue.MAX_ATTEMPTS):
+        monkeypatch.setattr(write_queue, "_retry_at", {})
+        queue.flush_pending(BrokenSheetsService([SHEET_NAME]))
+    assert queue.row_status([key]) == {key: "failed"}
+
+    queue.retry_rows([key])
+    monkeypatch.setattr(write_queue, "_retry_at", {})
+    service = FakeSheetsService([SHEET_NAME])
+    queue.flush_pending(service)
+
+    assert queue.row_status([key]) == {key: "flushed"}
+    assert len(service.appended[SHEET_NAME]) == 1
+
+
+def test_sheet_ids_are_fetched_once_per_spreadsheet(queue):
+    service = FakeSheetsService([SHEET_NAME])
+    calls = []
+    get = service.get
+    service.get = lambda **kwargs: calls.append(kwargs) or get(**kwargs)
+
+    _enqueue_quotation("Q0001")
+    queue.flush_pending(service)
+    _enqueue_quotation("Q0002")
+    queue.flush_pending(service)
+
+    assert len(calls) == 1
+    assert [row[0] for row in service.appended[SHEET_NAME]] == ["Q0001", "Q0002"]
+
+
+def test_prune_drops_only_old_flushed_rows(queue, monkeypatch):
+    _enqueue_quotation("Q0001")
+    queue.flush_pending(FakeSheetsService([SHEET_NAME]))
+    _enqueue_quotation("Q0002")
+    old, new = f"{SPREADSHEET_ID}:{SHEET_NAME}:Q0001", f"{SPREADSHEET_ID}:{SHEET_NAME}:Q0002"
+
+    queue.prune_flushed()
+    assert queue.row_status([old, new]) == {old: "flushed", new: "pending"}
+
+    monkeypatch.setattr(write_queue, "FLUSHED_RETENTION", -1)
+    queue.prune_flushed()
+    assert queue.row_status([old, new]) == {old: None, new: "pending"}
@@ -10,9 +10,17 @@ from datetime import datetime
 import json
 import os
 import pandas as pd
-
-SERVICES_FILE = "services.json"
-TEMP_DIR = "temp_uploads"
+from write_queue import enqueue_rows
+from id_allocator import REQUEST_COUNTER, CounterNotReconciledError, next_value, reconcile_counter
+from resilience import resilient_call
+from clients import get_drive_service, get_gspread_client, get_sheets_service
+from spool import SPOOL_ROOT, session_spool_dir, spool_upload
+from drafts import load_draft, reset_draft, save_draft, upsert_draft_service
+from locations import country_options, country_position, load_cities_index, load_ports_index, location_options, location_search_index
+from search import search_selectbox
+from cache_manager import cached, define_region, invalidate_on_write
+
+TEMP_DIR = SPOOL_ROOT
 
 all_quotes_columns =[
     "request_id", "time", "commercial", "service", "client", "client_reference", "incoterm", "commodity", "hs_code", "transport_type", "modality", "routes_info", "ground_routes", "country_origin", "country_destination", "pickup_address", "zip_code_origin", "delivery_address", "zip_code_destination", "addresses",
@@ -25,60 +33,32 @@ DRIVE_ID = st.secrets["general"]["drive_id"]
 time_sheet_id = st.secrets["general"]["time_sheet_id"]
 PARENT_FOLDER_ID = st.secrets["general"]["parent_folder"]
 
-sheets_creds= Credentials.from_service_account_info(
-    st.secrets["google_sheets_credentials"],
-    scopes=[
-        "https://www.googleapis.com/auth/spreadsheets",
-        "https://www.googleapis.com/auth/drive"
-    ]
-)
-
-sheets_service = build('sheets', 'v4', credentials=sheets_creds)
-
-drive_creds = Credentials.from_service_account_info(
-    st.secrets["google_drive_credentials"],
-    scopes=["https://www.googleapis.com/auth/drive"]
-)
+sheets_service = get_sheets_service()
+drive_service = get_drive_service()
+client_gcp = get_gspread_client()
 
-drive_service = build('drive', 'v3', credentials=drive_creds)
-client_gcp = gspread.authorize(sheets_creds)
+define_region("clients", max_entries=1, ttl=3600)
+# La lista de clientes se vuelve a leer solo cuando la cola confirma un cliente nuevo en "clientes"
+invalidate_on_write("clients", time_sheet_id, "clientes")
 
-def save_file_locally(file, temp_dir=TEMP_DIR):
+def save_file_locally(file, temp_dir=None):
     try:
+        if temp_dir is None:
+            temp_dir = session_spool_dir()
         os.makedirs(temp_dir, exist_ok=True)
 
-        temp_file_path = os.path.join(temp_dir, file.name)
-
-        with open(temp_file_path, "wb") as temp_file:
-            temp_file.write(file.getbuffer())  
-
-        return temp_file_path
+        return spool_upload(file, temp_dir)
 
     except Exception as e:
         st.error(f"⚠️ Error al guardar el archivo: {e}")
         return None
 
-@st.cache_data(ttl=3600000)
-def load_csv(file):
-    df = pd.read_csv(file)
-    return df
-
 def save_csv(file, new_client):
     file_exists = os.path.exists(file)
     
     with open(file, "a") as f:
         f.write(f"{new_client}\n")
 
-def folder(request_id):
-    if validate_shared_drive_folder(PARENT_FOLDER_ID):
-        folder_id = create_folder(request_id, PARENT_FOLDER_ID)
-        if not folder_id:
-            st.error("Failed to create folder for this request.")
-        else:
-            folder_link = f"https://drive.google.com/drive/folders/{folder_id}"
-
-    return folder_id, folder_link
-
 def cargo(service):
     temp_details = st.session_state.get("temp_details", {})
     transport_type = temp_details.get("transport_type", "")
@@ -508,29 +488,18 @@ def handle_remove_route(index):
 def handle_routes(transport_type):
     initialize_routes()
     
-    if transport_type == "Air":
-        if "cities_csv" not in st.session_state or st.session_state["cities_csv"] is None:
-            try:
-                st.session_state["cities_csv"] = load_csv("cities_world.csv")
-            except Exception as e:
-                st.error(f"⚠️ Error cargando cities_world.csv: {e}")
-                return
-        csv_data = st.session_state["cities_csv"]
-        csv_data = st.session_state.get("cities_csv", {})
-        route_options = csv_data.get("Country", pd.Series()).dropna().astype(str).unique().tolist()
-
-    elif transport_type == "Maritime":
-        if "ports_csv" not in st.session_state or st.session_state["ports_csv"] is None:
-            try:
-                st.session_state["ports_csv"] = load_csv("output_port_world.csv")
-            except Exception as e:
-                st.error(f"⚠️ Error cargando output_port_world.csv: {e}")
-                return
-        csv_data = st.session_state["ports_csv"]
-        csv_data = st.session_state.get("ports_csv", {})
-        route_options = csv_data.get("country", pd.Series()).dropna().astype(str).unique().tolist()
-    else:
-        route_options = []
+    try:
+        if transport_type == "Air":
+            index = load_cities_index()
+        elif transport_type == "Maritime":
+            index = load_ports_index()
+        else:
+            index = None
+    except Exception as e:
+        st.error(f"⚠️ Error cargando la lista de {'ciudades' if transport_type == 'Air' else 'puertos'}: {e}")
+        return
+
+    route_options = country_options(index) if index else [""]
 
     for i in range(len(st.session_state["routes"])):
         route = st.session_state["routes"][i]
@@ -542,21 +511,20 @@ def handle_routes(transport_type):
             with col1:
                 country_origin = st.selectbox(
                     "Country of Origin*",
-                    options=[""] + route_options,
+                    options=route_options,
                     key=f"country_origin_{i}",
-                    index=(route_options.index(route["country_origin"]) + 1) if route["country_origin"] in route_options else 0,
+                    index=country_position(index, route["country_origin"]) if index else 0,
                 )
                 st.session_state["routes"][i]["country_origin"] = country_origin
             
             with col2:
-                filtered_ports = csv_data[csv_data["Country"] == country_origin]["City"].dropna().unique().tolist() if transport_type == "Air" and country_origin else []
-                if transport_type == "Maritime" and country_origin:
-                    filtered_ports = csv_data[csv_data["country"] == country_origin]["port name"].dropna().unique().tolist()
-                port_origin = st.selectbox(
+                port_origin = search_selectbox(
                     "Port of Origin*",
-                    options=[""] + filtered_ports,
+                    location_options(index, country_origin) if index else [""],
                     key=f"port_origin_{i}",
-                    index=(filtered_ports.index(route["port_origin"]) + 1) if route["port_origin"] in filtered_ports else 0,
+                    value=route["port_origin"],
+                    fixed=[""],
+                    index=location_search_index(index, country_origin) if index else None,
                 )
                 st.session_state["routes"][i]["port_origin"] = port_origin
         
@@ -565,21 +533,20 @@ def handle_routes(transport_type):
             with col1:
                 country_destination = st.selectbox(
                     "Country of Destination*",
-                    options=[""] + route_options,
+                    options=route_options,
                     key=f"country_destination_{i}",
-                    index=(route_options.index(route["country_destination"]) + 1) if route["country_destination"] in route_options else 0,
+                    index=country_position(index, route["country_destination"]) if index else 0,
                 )
                 st.session_state["routes"][i]["country_destination"] = country_destination
             
             with col2:
-                filtered_ports = csv_data[csv_data["Country"] == country_destination]["City"].dropna().unique().tolist() if transport_type == "Air" and country_destination else []
-                if transport_type == "Maritime" and country_destination:
-                    filtered_ports = csv_data[csv_data["country"] == country_destination]["port name"].dropna().unique().tolist()
-                port_destination = st.selectbox(
+                port_destination = search_selectbox(
                     "Port of Destination*",
-                    options=[""] + filtered_ports,
+                    location_options(index, country_destination) if index else [""],
                     key=f"port_destination_{i}",
-                    index=(filtered_ports.index(route["port_destination"]) + 1) if route["port_destination"] in filtered_ports else 0,
+                    value=route["port_destination"],
+                    fixed=[""],
+                    index=location_search_index(index, country_destination) if index else None,
                 )
                 st.session_state["routes"][i]["port_destination"] = port_destination
             
@@ -710,8 +677,8 @@ def remove_ground_route(index):
 def ground_transport():
     initialize_ground_routes()
     temp_details = st.session_state.get("temp_details", {})
-    data = st.session_state.get("cities_csv", [])
-    countries = data["Country"].dropna().unique().tolist()
+    index = load_cities_index()
+    countries = country_options(index)
     routes = [] 
 
     for i, route in enumerate(st.session_state["ground_routes"]):
@@ -720,20 +687,15 @@ def ground_transport():
         col1, col2, col3, col4 = st.columns(4)
         with col1:
             country_origin = st.selectbox(
-                f"Country of Origin*", options=[""] + countries, key=f"country_origin_{i}",
-                index=(countries.index(temp_details.get("country_origin", "")) + 1)
-                if temp_details.get("country_origin", "") in countries else 0,
+                f"Country of Origin*", options=countries, key=f"country_origin_{i}",
+                index=country_position(index, temp_details.get("country_origin", "")),
             )
 
-        filtered_cities = []
-        if country_origin:
-            filtered_cities = (data[data["Country"] == country_origin]["City"].dropna().unique().tolist())
-
         with col2:
-            city_origin = st.selectbox(
-                f"City of Origin*", options=[""] + filtered_cities, key=f"city_origin_{i}",
-                index=(filtered_cities.index(temp_details.get("city_origin", "")) + 1)
-                if temp_details.get("city_origin", "") in filtered_cities else 0,
+            city_origin = search_selectbox(
+                f"City of Origin*", location_options(index, country_origin), key=f"city_origin_{i}",
+                value=temp_details.get("city_origin", ""), fixed=[""],
+                index=location_search_index(index, country_origin),
             )
         with col3:
             pickup_address = st.text_input(
@@ -745,20 +707,15 @@ def ground_transport():
         col1, col2, col3, col4 = st.columns(4)
         with col1:
             country_destination = st.selectbox(
-                f"Country of Destination*", options=[""] + countries, key=f"country_destination_{i}",
-                index=(countries.index(temp_details.get("country_destination", "")) + 1)
-                if temp_details.get("country_destination", "") in countries else 0,
+                f"Country of Destination*", options=countries, key=f"country_destination_{i}",
+                index=country_position(index, temp_details.get("country_destination", "")),
             )
 
-        filtered_cities_destination = []
-        if country_destination:
-            filtered_cities_destination = (data[data["Country"] == country_destination]["City"].dropna().unique().tolist())
-
         with col2:
-            city_destination = st.selectbox(
-                f"City of Destination*", options=[""] + filtered_cities_destination, key=f"city_destination_{i}",
-                index=(filtered_cities_destination.index(temp_details.get("city_destination", "")) + 1)
-                if temp_details.get("city_destination", "") in filtered_cities_destination else 0,
+            city_destination = search_selectbox(
+                f"City of Destination*", location_options(index, country_destination), key=f"city_destination_{i}",
+                value=temp_details.get("city_destination", ""), fixed=[""],
+                index=location_search_index(index, country_destination),
             )
 
         with col3:
@@ -888,21 +845,19 @@ def lcl_questions(transport_type):
 
 def customs_questions(service, customs=False):
     temp_details = st.session_state.get("temp_details", {})
-    data = st.session_state.get("cities_csv", [])
-    countries = data["Country"].dropna().unique().tolist()
+    index = load_cities_index()
+    countries = country_options(index)
     customs_data = {}
     if not customs:
         col1, col2 = st.columns(2)
         with col1:
-            country_origin = st.selectbox("Country of Origin*", options=[""] + countries, key="country_origin",
-                index=(countries.index(temp_details.get("country_origin", "")) + 1)
-                if temp_details.get("country_origin", "") in countries else 0,
+            country_origin = st.selectbox("Country of Origin*", options=countries, key="country_origin",
+                index=country_position(index, temp_details.get("country_origin", "")),
             )
         with col2:
             country_destination = st.selectbox(
-            "Country of Destination", options=[""] + countries, key="country_destination",
-            index=(countries.index(temp_details.get("country_destination", "")) + 1)
-            if temp_details.get("country_destination", "") in countries else 0,
+            "Country of Destination", options=countries, key="country_destination",
+            index=country_position(index, temp_details.get("country_destination", "")),
         )
         commodity = st.text_input("Commodity*", key="commodity", value=temp_details.get("commodity", ""))
         hs_code = st.text_input("HS Code*", key="hs_code", value=temp_details.get("hs_code", ""))
@@ -1223,6 +1178,7 @@ def handle_add_service():
             "service": service,
             "details": temp_details
         }
+        upsert_draft_service(st.session_state["services"][edit_index], edit_index)
         st.success("Servicio succesfully edited.")
         del st.session_state["edit_index"]
     else:
@@ -1230,164 +1186,75 @@ def handle_add_service():
             "service": service,
             "details": temp_details
         })
+        upsert_draft_service(st.session_state["services"][-1])
         st.success("Service succesfully added.")
 
-    save_services(st.session_state["services"])
     st.session_state["temp_details"] = {}
     change_page("requested_services")
 
 def change_page(new_page):
     st.session_state["page"] = new_page
 
-def save_to_google_sheets(dataframe, sheet_id, max_attempts=5):
+def save_to_google_sheets(dataframe, sheet_id):
 
     temp_service = dataframe["service"].astype(str).str.replace("\n", ", ")
     is_ground = temp_service.str.contains(r"\bGround Transportation\b", na=False, regex=True)
     contains_ground = is_ground.any()
 
-    attempts = 0
-    while attempts < max_attempts:
-        try:
-            if contains_ground: 
-                save_data_to_google_sheets(dataframe, sheet_id, "Ground Quotations")
-                if temp_service.str.contains(",").any():
-                    save_data_to_google_sheets(dataframe, sheet_id, "All Quotes")
-            else:
-                save_data_to_google_sheets(dataframe, sheet_id, "All Quotes")
-
-            return 
-
-        except Exception as e:
-            attempts += 1
-            st.error(f"Intento {attempts}/{max_attempts}: Error al guardar en Google Sheets: {e}")
-            if attempts == max_attempts:
-                st.error("Se alcanzó el máximo de intentos. No se pudo guardar la cotización.")
-                raise e
-
-def save_data_to_google_sheets(dataframe, sheet_id, sheet_name, max_attempts=5):
-    attempts = 0
-    while attempts < max_attempts:
-        try:
-            sheet = client_gcp.open_by_key(sheet_id)
-
-            try:
-                worksheet = sheet.worksheet(sheet_name)
-                if worksheet.row_count == 0:
-                    worksheet.append_row([col.upper() for col in dataframe.columns])
-
-            except gspread.exceptions.WorksheetNotFound:
-                worksheet = sheet.add_worksheet(title=sheet_name, rows="10000", cols="50")
-                worksheet.append_row([col.upper() for col in dataframe.columns])
-
-            dataframe.columns = dataframe.columns.str.upper()
-            new_data = dataframe.fillna("").values.tolist()
-            worksheet.append_rows(new_data, table_range="A2")
-
-            return
-
-        except Exception as e:
-            attempts += 1
-            st.error(f"Intento {attempts}/{max_attempts}: Error al guardar en Google Sheets ({sheet_name}): {e}")
-            if attempts == max_attempts:
-                st.error(f"Se alcanzó el máximo de intentos. No se pudo guardar la cotización en {sheet_name}.")
-                raise e
-
-def validate_shared_drive_folder(parent_folder_id):
-    try:
-        folder = drive_service.files().get(
-            fileId=parent_folder_id,
-            fields='id',
-            supportsAllDrives=True
-        ).execute()
-        return folder is not None
-    except Exception as e:
-        st.error(f"Parent folder not found or inaccessible: {e}")
-        return False
-
-def get_folder_id(folder_name, parent_folder_id):
-    try:
-        query = f"name = '{folder_name}' and mimeType = 'application/vnd.google-apps.folder' and '{parent_folder_id}' in parents and trashed = false"
-        response = drive_service.files().list(
-            q=query,
-            spaces='drive',
-            fields='files(id, name)',
-            supportsAllDrives=True
-        ).execute()
-        files = response.get('files', [])
-        if files:
-            return files[0]['id']
-        return None
-    except Exception as e:
-        st.error(f"Failed to search for folder: {e}")
-        return None
+    # Devuelve las claves encoladas para poder seguir su estado en la cola de escritura
+    keys = []
+    if contains_ground: 
+        keys += save_data_to_google_sheets(dataframe, sheet_id, "Ground Quotations")
+        if temp_service.str.contains(",").any():
+            keys += save_data_to_google_sheets(dataframe, sheet_id, "All Quotes")
+    else:
+        keys += save_data_to_google_sheets(dataframe, sheet_id, "All Quotes")
+    return keys
 
-def create_folder(folder_name, parent_folder_id):
-    existing_folder_id = get_folder_id(folder_name, parent_folder_id)
-    if existing_folder_id:
-        st.info(f"Folder '{folder_name}' already exists with ID: {existing_folder_id}")
-        return existing_folder_id
+def save_data_to_google_sheets(dataframe, sheet_id, sheet_name):
+    header = [col.upper() for col in dataframe.columns]
+    new_data = dataframe.fillna("").values.tolist()
+    keys = [f"{sheet_id}:{sheet_name}:{row[0]}" for row in new_data]
 
     try:
-        file_metadata = {
-            'name': folder_name,
-            'mimeType': 'application/vnd.google-apps.folder',
-            'parents': [parent_folder_id]
-        }
-        folder = drive_service.files().create(
-            body=file_metadata,
-            fields='id',
-            supportsAllDrives=True
-        ).execute()
-        
-        folder_id = folder.get('id')
-
-        return folder_id
-    
+        enqueue_rows(sheet_id, sheet_name, new_data, keys, header=header)
     except Exception as e:
-        st.error(f"Failed to create folder: {e}")
-        return None, None
+        st.error(f"Error al guardar la cotización en {sheet_name}: {e}")
+        raise e
+    return keys
 
 def log_time(start_time, end_time, duration, request_id, quotation_type):
     sheet_name = "TEST" #Cambiar a Duration Time Quotation
+    keys = [f"{time_sheet_id}:{sheet_name}:{request_id}"]
     try:
-        sheet = client_gcp.open_by_key(time_sheet_id)
-        try:
-            worksheet = sheet.worksheet(sheet_name)
-            start_time_str = start_time.strftime('%Y-%m-%d %H:%M:%S')
-            end_time_str = end_time.strftime('%Y-%m-%d %H:%M:%S')
-            worksheet.append_row([request_id, quotation_type, start_time_str, end_time_str, duration])
-        
-        except gspread.exceptions.WorksheetNotFound:
-            worksheet = sheet.add_worksheet(title=sheet_name, rows="1000", cols="20")
-            worksheet.append_row(["request_id", "quotation_type", "Start Time", "End Time", "Duration (seconds)"])
-            start_time_str = start_time.strftime('%Y-%m-%d %H:%M:%S')
-            end_time_str = end_time.strftime('%Y-%m-%d %H:%M:%S')
-            worksheet.append_row([request_id, quotation_type, start_time_str, end_time_str, duration])
+        start_time_str = start_time.strftime('%Y-%m-%d %H:%M:%S')
+        end_time_str = end_time.strftime('%Y-%m-%d %H:%M:%S')
+        enqueue_rows(
+            time_sheet_id, sheet_name,
+            [[request_id, quotation_type, start_time_str, end_time_str, duration]],
+            keys=keys,
+            header=["request_id", "quotation_type", "Start Time", "End Time", "Duration (seconds)"]
+        )
+        return keys
 
     except Exception as e:
         st.error(f"Failed to save data to Google Sheets: {e}")
 
 def load_services():
-    if os.path.exists(SERVICES_FILE):
-        with open(SERVICES_FILE, "r") as file:
-            return json.load(file)
-    return []
+    return load_draft()
 
 def save_services(services):
-    with open(SERVICES_FILE, "w") as file:
-        json.dump(services, file, indent=4)
+    save_draft(services)
 
 def reset_json():
-    if os.path.exists(SERVICES_FILE):
-        os.remove(SERVICES_FILE)
-    with open(SERVICES_FILE, "w") as file:
-        json.dump([], file)
+    reset_draft()
 
 if not os.path.exists(TEMP_DIR):
     os.makedirs(TEMP_DIR)
 
-def handle_file_uploads(file_uploader_key, label="Attach Files*", temp_dir=TEMP_DIR):
-    os.makedirs(temp_dir, exist_ok=True)
+def handle_file_uploads(file_uploader_key, label="Attach Files*", temp_dir=None):
+    if temp_dir is None:
+        temp_dir = session_spool_dir()
 
     if file_uploader_key not in st.session_state:
         st.session_state[file_uploader_key] = {}
@@ -1414,78 +1281,83 @@ def handle_file_uploads(file_uploader_key, label="Attach Files*", temp_dir=TEMP_
 
     return list(st.session_state[file_uploader_key].values())
 
-def upload_all_files_to_google_drive(folder_id, drive_service):
+def load_existing_ids_from_sheets():
+    sheet_name = "Duration Time Quotation" 
     try:
-        file_list = drive_service.files().list(q=f"'{folder_id}' in parents", fields="files(name)").execute()
-        existing_files = {file['name'] for file in file_list.get('files', [])}
-
-        for root, _, files in os.walk(TEMP_DIR):
-            for file_name in files:
-                file_path = os.path.join(root, file_name)
-                
-                if file_name not in existing_files: 
-                    with open(file_path, "rb") as file:
-                        file_metadata = {'name': file_name, 'parents': [folder_id]}
-                        media = MediaFileUpload(file_path, resumable=True)
-
-                        drive_service.files().create(
-                            body=file_metadata,
-                            media_body=media,
-                            fields='id',
-                            supportsAllDrives=True
-                        ).execute()
-
-                        #st.success(f"Uploaded file: {file_name}")
-
-                    try:
-                        os.remove(file_path)
-                    except Exception as e:
-                        st.error(f"Error al eliminar {file_name}: {e}")
+        sheet = resilient_call("sheets", client_gcp.open_by_key, time_sheet_id)
 
-                else:
-                    st.warning(f"El archivo {file_name} ya existe en Google Drive. No se subirá de nuevo.")
+        worksheet_list = [ws.title for ws in resilient_call("sheets", sheet.worksheets)]
+        if sheet_name not in worksheet_list:
+            return set()
+
+        worksheet = resilient_call("sheets", sheet.worksheet, sheet_name)
+        existing_ids = resilient_call("sheets", worksheet.col_values, 1)
+        return set(existing_ids[1:]) 
+
+    except gspread.exceptions.SpreadsheetNotFound:
+        st.error("The spreadsheet with the provided ID was not found.")
+
+    except gspread.exceptions.WorksheetNotFound:
+        st.error(f"The worksheet '{sheet_name}' was not found in the spreadsheet.")
 
     except Exception as e:
-        st.error(f"Error al subir archivos a Google Drive: {e}")
+        st.error(f"Error while loading IDs from Google Sheets: {e}")
 
-def load_existing_ids_from_sheets():
-    sheet_name = "Duration Time Quotation" 
-    while True: 
-        try:
-            sheet = client_gcp.open_by_key(time_sheet_id)
+    return None
 
-            worksheet_list = [ws.title for ws in sheet.worksheets()]
-            if sheet_name not in worksheet_list:
-                return set()
+@st.cache_resource
+def _request_counter_state():
+    return {"reconciled": False}
 
-            worksheet = sheet.worksheet(sheet_name)
-            existing_ids = worksheet.col_values(1)
-            return set(existing_ids[1:]) 
+def reconcile_request_counter():
+    state = _request_counter_state()
+    if state["reconciled"]:
+        return
+
+    existing_ids = load_existing_ids_from_sheets()
+    if existing_ids is None:
+        # Sin acceso a la hoja se sigue con el contador local (solo si esta base ya se reconcilió
+        # alguna vez; si no, next_value se niega) y se reintenta en la próxima solicitud
+        return
 
-        except gspread.exceptions.SpreadsheetNotFound:
-            st.error("The spreadsheet with the provided ID was not found. Retrying...")
+    sequence_ids = [
+        int(id[1:]) for id in existing_ids 
+        if id.startswith('Q') and id[1:].isdigit()
+    ]
+    reconcile_counter(REQUEST_COUNTER, max(sequence_ids, default=0))
+    state["reconciled"] = True
+
+def generate_request_id():
+    if "generated_ids" not in st.session_state:
+        st.session_state["generated_ids"] = set()
 
-        except gspread.exceptions.WorksheetNotFound:
-            st.error(f"The worksheet '{sheet_name}' was not found in the spreadsheet. Retrying...")
+    reconcile_request_counter()
+    try:
+        unique_id = f"Q{next_value(REQUEST_COUNTER):04d}"
+    except CounterNotReconciledError:
+        st.error("Could not read the existing request IDs from Google Sheets, so a new ID cannot be assigned "
+                 "safely. Please try again in a moment.")
+        raise
 
-        except Exception as e:
-            st.error(f"Error while loading IDs from Google Sheets: {e}. Retrying...")
+    st.session_state["generated_ids"].add(unique_id)
+    return unique_id
 
-@st.cache_data(ttl=3600)
+@cached("clients", keys=lambda: [(time_sheet_id, "clientes")])
 def load_clients():
     sheet_name = "clientes"
     
     try:
-        sheet = client_gcp.open_by_key(time_sheet_id)
-        worksheet_list = [ws.title for ws in sheet.worksheets()]
+        sheet = resilient_call("sheets", client_gcp.open_by_key, time_sheet_id)
+        worksheet_list = [ws.title for ws in resilient_call("sheets", sheet.worksheets)]
         
         if sheet_name not in worksheet_list:
             return []
 
-        worksheet = sheet.worksheet(sheet_name)
-        clientes = worksheet.col_values(1)
+        worksheet = resilient_call("sheets", sheet.worksheet, sheet_name)
+        clientes = resilient_call("sheets", worksheet.col_values, 1)
 
-        return clientes[1:]
+        # Compartida entre sesiones: cada sesión trabaja sobre su propia lista
+        return tuple(clientes[1:])
 
     except gspread.exceptions.SpreadsheetNotFound:
         st.error("No se encontró la hoja de cálculo con el ID proporcionado.")
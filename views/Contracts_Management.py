@@ -5,13 +5,27 @@ import streamlit as st
 import numpy as np
 from cotizacion import *
 import json
-from utils import load_existing_ids_from_sheets, log_time
+import copy
+import re
+import zipfile
+from io import BytesIO
+from id_allocator import CounterNotReconciledError
+from utils import generate_request_id, log_time
+from snapshots import get_drive_revision, load_worksheet_snapshot
+from write_queue import enqueue_rows
+from resilience import resilient_call
+from clients import get_drive_service, get_gspread_client
+from pricing import build_cost_tables, cost_of
+from cache_manager import cached, define_region
+from contract_index import lane_commodities, lane_pods, lane_pols, lane_rows, load_contracts_view
 import pytz
 from datetime import datetime
 import datetime as dt
 
 colombia_timezone = pytz.timezone('America/Bogota')
 
+define_region("contracts", max_entries=2, ttl=300)
+
 def get_valid_value(primary, fallback):
     if pd.notna(primary) and str(primary).strip(): 
         return primary
@@ -21,13 +35,12 @@ def get_valid_value(primary, fallback):
         return "" 
 
 
-def parse_price(value):
-    if isinstance(value, str) and value.strip().upper() == "INCLUIDO":
-        return "INCLUIDO"
-    try:
-        return float(value.replace('$', '').replace('.', '').replace(',', '.'))
-    except ValueError:
-        return value 
+EMPTY_COST_TABLE = {
+    "display": pd.DataFrame(),
+    "amounts": pd.DataFrame(),
+    "included": pd.DataFrame(),
+    "cargo_types": [],
+}
 
 def validate_inputs(client, cargo_types, incoterm, cargo_value, selected_surcharges, surcharge_values):
     errors = []
@@ -50,60 +63,15 @@ def validate_inputs(client, cargo_types, incoterm, cargo_value, selected_surchar
 
     return errors
 
-def generate_request_id():
-    if "generated_ids" not in st.session_state:
-        st.session_state["generated_ids"] = set()
-
-    existing_ids = load_existing_ids_from_sheets()
-    new_sequence_ids = [
-        int(id[1:]) for id in existing_ids 
-        if id.startswith('Q') and id[1:].isdigit()
-    ]
-
-    if new_sequence_ids:
-        next_id = max(new_sequence_ids) + 1
-    else:
-        next_id = 1 
-
-    unique_id = f"Q{next_id:04d}"
-
-    st.session_state["generated_ids"].add(unique_id)
-    return unique_id
-
-
-def save_to_google_sheets(data, start_time):
-    SPREADSHEET_ID = st.secrets['general']['costs_sales_contracts']
-    SHEET_NAME = "CONTRATOS"
-
-    credentials = Credentials.from_service_account_info(
-        st.secrets["google_sheets_credentials"],
-        scopes=["https://www.googleapis.com/auth/spreadsheets", 
-                "https://www.googleapis.com/auth/drive"]
-    )
-
-    gc = gspread.authorize(credentials)
-    try:
-        sheet = gc.open_by_key(SPREADSHEET_ID)
-        try:
-            worksheet = sheet.worksheet(SHEET_NAME)
-        except gspread.exceptions.WorksheetNotFound:
-            worksheet = sheet.add_worksheet(title=SHEET_NAME, rows="1000", cols="30")
-            st.warning(f"Worksheet '{SHEET_NAME}' was created.")
-            headers = [
-                "Cotización ID", "Commercial", "Time", "Cliente", "Incoterm", "POL", "POD", "Commodity", "Contrato ID",
-                "Cargo Types", "Cargo Value", "Surcharges (Costos)", "Surcharges (Ventas)", 
-                "Additional Surcharges (Costos)", "Additional Surcharges (Ventas)", 
-                "Total Cost", "Total Sale", "Total Profit"
-            ]
-
-            worksheet.append_row(headers)
-    except gspread.exceptions.SpreadsheetNotFound:
-        st.error("The specified Google Sheets document was not found.")
-        return
-
-    if not st.session_state.get("request_id"): 
-        st.session_state["request_id"] = generate_request_id()
+CONTRACTS_SHEET = "CONTRATOS"
+CONTRACTS_HEADERS = [
+    "Cotización ID", "Commercial", "Time", "Cliente", "Incoterm", "POL", "POD", "Commodity", "Contrato ID",
+    "Cargo Types", "Cargo Value", "Surcharges (Costos)", "Surcharges (Ventas)", 
+    "Additional Surcharges (Costos)", "Additional Surcharges (Ventas)", 
+    "Total Cost", "Total Sale", "Total Profit"
+]
 
+def build_contract_row(data, request_id, end_time_str):
     client = data["client"]
     incoterm = data["incoterm"]
     cargo_types = "\n".join(data["cargo_types"]) 
@@ -141,6 +109,21 @@ def save_to_google_sheets(data, start_time):
     additional_surcharge_costs_str = "\n".join(additional_surcharge_costs) 
     additional_surcharge_sales_str = "\n".join(additional_surcharge_sales)
 
+    return [
+        request_id, commercial, end_time_str, client, incoterm, 
+        data["pol"], data["pod"], data["commodity"], data["contract_id"],
+        cargo_types, cargo_value, surcharge_costs_str, surcharge_sales_str, 
+        additional_surcharge_costs_str, additional_surcharge_sales_str,
+        f"${total_cost:.2f}", f"${total_sale:.2f}", f"${total_profit:.2f}"
+    ]
+
+def save_to_google_sheets(data, start_time):
+    save_quotations_to_google_sheets([data], start_time)
+
+def save_quotations_to_google_sheets(quotations, start_time):
+    SPREADSHEET_ID = st.secrets['general']['costs_sales_contracts']
+    SHEET_NAME = CONTRACTS_SHEET
+
     st.session_state["end_time"] = datetime.now(pytz.utc).astimezone(colombia_timezone)
     end_time = st.session_state.get("end_time", None)
     if end_time is not None:
@@ -156,29 +139,92 @@ def save_to_google_sheets(data, start_time):
         st.error("Error: 'start_time' o 'end_time' no están definidos. No se puede calcular la duración.")
         return
 
-    row = [
-        st.session_state["request_id"], commercial, end_time_str, client, incoterm, 
-        data["pol"], data["pod"], data["commodity"], data["contract_id"],
-        cargo_types, cargo_value, surcharge_costs_str, surcharge_sales_str, 
-        additional_surcharge_costs_str, additional_surcharge_sales_str,
-        f"${total_cost:.2f}", f"${total_sale:.2f}", f"${total_profit:.2f}"
-    ]
-    worksheet.append_row(row)
+    # Una cotización por cliente, todas las filas en un solo append. Cada cotización guardada lleva
+    # su propio ID: la cola descarta las claves repetidas y un ID por sesión perdería filas
+    rows = []
+    for data in quotations:
+        if not data.get("request_id"):
+            data["request_id"] = generate_request_id()
+        rows.append(build_contract_row(data, data["request_id"], end_time_str))
+
+    enqueue_rows(
+        SPREADSHEET_ID, SHEET_NAME, rows,
+        keys=[f"{SPREADSHEET_ID}:{SHEET_NAME}:{row[0]}" for row in rows], header=CONTRACTS_HEADERS
+    )
     
-    log_time(start_time, end_time, duration, st.session_state["request_id"], quotation_type="Contracts")
+    for row in rows:
+        log_time(start_time, end_time, duration, row[0], quotation_type="Contracts")
+
+def apply_markup(data, client, markup):
+    quotation = copy.deepcopy(data)
+    quotation["client"] = client
+    factor = 1 + markup / 100
+
+    total_profit = 0
+    for details in quotation["surcharges"].values():
+        for values in details.values():
+            values["sale"] = round(values["sale"] * factor, 2)
+            total_profit += values["sale"] - values["cost"]
+    for add_surcharge in quotation["additional_surcharges"]:
+        add_surcharge["sale"] = round(add_surcharge["sale"] * factor, 2)
+        total_profit += add_surcharge["sale"] - add_surcharge["cost"]
+    quotation["total_profit"] = total_profit
+    return quotation
+
+def generate_bulk_quotations(data, clients, start_time):
+    quotations = [apply_markup(data, client, markup) for client, markup in clients]
+    for quotation in quotations:
+        quotation["request_id"] = generate_request_id()
+
+    save_quotations_to_google_sheets(quotations, start_time)
+    st.success(f"{len(quotations)} quotations saved successfully to Google Sheets!")
+
+    # Cada documento se escribe en el ZIP apenas está listo y se libera; los .xlsx ya vienen
+    # comprimidos, así que el ZIP solo los empaqueta
+    archive = BytesIO()
+    with zipfile.ZipFile(archive, "w", zipfile.ZIP_STORED) as zip_file:
+        for quotation, document in generate_quotations(quotations):
+            if isinstance(document, Exception):
+                st.error(f"Could not generate the quotation for {quotation['client']}: {document}")
+                continue
+            client_name = re.sub(r"[^\w\-]+", "_", quotation["client"]).strip("_")
+            zip_file.writestr(f"{quotation['request_id']}_{client_name}.xlsx", document.getbuffer())
+            document.close()
+    archive.seek(0)
+
+    st.download_button(
+        label="Download Quotations (ZIP)",
+        data=archive,
+        file_name=f"quotations_{data['contract_id']}.zip",
+        mime="application/zip"
+    )
 
 incoterm_op = ['CIF', 'CFR', 'FOB', 'CPT', 'DAP']
 
 @st.dialog("Generate Quotation", width="large")
-def select_options(contrato_id, available_cargo_types, tabla_pivot):
+def select_options(contrato_id, cost_table):
     if st.session_state.get("start_time") is None:
         st.session_state["start_time"] = datetime.now(colombia_timezone)
 
     start_time = st.session_state["start_time"]
 
     incoterm = st.selectbox('Select Incoterm', incoterm_op, key=f'incoterm_{contrato_id}')
-    client = st.text_input('Client', key=f'client_{contrato_id}')
-    cargo_types = st.multiselect('Select Cargo Type', available_cargo_types, key=f'cargo_{contrato_id}')
+    bulk = st.toggle('Bulk mode (several clients)', key=f'bulk_{contrato_id}')
+    if bulk:
+        st.caption('One quotation per client. The markup (%) is applied over the sale values below.')
+        bulk_clients = st.data_editor(
+            pd.DataFrame({"Client": pd.Series(dtype=str), "Markup (%)": pd.Series(dtype=float)}),
+            num_rows="dynamic", use_container_width=True, key=f'bulk_clients_{contrato_id}'
+        )
+        clients = [
+            (str(name).strip(), float(markup) if pd.notna(markup) else 0.0)
+            for name, markup in bulk_clients[["Client", "Markup (%)"]].itertuples(index=False)
+            if pd.notna(name) and str(name).strip()
+        ]
+        client = ", ".join(name for name, _ in clients)
+    else:
+        client = st.text_input('Client', key=f'client_{contrato_id}')
+    cargo_types = st.multiselect('Select Cargo Type', cost_table["cargo_types"], key=f'cargo_{contrato_id}')
 
     cargo_value = 0.0
     insurance_cost = 0.0
@@ -192,9 +238,8 @@ def select_options(contrato_id, available_cargo_types, tabla_pivot):
         st.warning('Please select a container to continue')
         return
 
-    available_surcharges = [s for s in tabla_pivot.index if s in ["Origen", "Flete", "Destino", "Hbl", "Switch"]]
+    available_surcharges = [s for s in cost_table["amounts"].index if s in ["Origen", "Flete", "Destino", "Hbl", "Switch"]]
     selected_surcharges = st.multiselect('Select Surcharges', available_surcharges, key=f'surcharges_{contrato_id}')
-    tabla_pivot = tabla_pivot.map(parse_price)
 
     surcharge_values = {surcharge: {} for surcharge in selected_surcharges}
     total_profit = 0
@@ -209,21 +254,7 @@ def select_options(contrato_id, available_cargo_types, tabla_pivot):
 
         for idx, cont in enumerate(cargo_types):
             with cols[idx * 2]:
-                if surcharge in tabla_pivot.index and cont in tabla_pivot.columns:
-                    cost_value = tabla_pivot.at[surcharge, cont]
-                    try:
-                        if isinstance(cost_value, str) and cost_value.upper() == "INCLUIDO":
-                            cost_display = "INCLUIDO"
-                            cost_value = 0.0
-                        else:
-                            cost_value = float(cost_value)
-                            cost_display = f"${cost_value:.2f}"
-                    except (KeyError, ValueError):
-                        cost_display = "Not Available"
-                        cost_value = 0.0
-                else:
-                    cost_display = "Not Available"
-                    cost_value = 0.0
+                cost_value, cost_display = cost_of(cost_table, surcharge, cont)
 
                 st.write(f'**Cost of {surcharge}**')
                 st.write(cost_display)
@@ -272,7 +303,7 @@ def select_options(contrato_id, available_cargo_types, tabla_pivot):
     
     st.write(f'**Total Profit: ${total_profit:.2f}**')
 
-    if st.button("Generate Quotation"):
+    if st.button("Generate Quotations" if bulk else "Generate Quotation"):
         errors = validate_inputs(client, cargo_types, incoterm, cargo_value, selected_surcharges, surcharge_values)
 
         if errors:
@@ -295,21 +326,30 @@ def select_options(contrato_id, available_cargo_types, tabla_pivot):
             "contract_id": contrato_id  
     }
 
-        st.write(quotation_data)
+        try:
+            if bulk:
+                generate_bulk_quotations(quotation_data, clients, start_time)
+                return
 
-        save_to_google_sheets(quotation_data, start_time)
+            st.write(quotation_data)
+
+            save_to_google_sheets(quotation_data, start_time)
+        except CounterNotReconciledError:
+            # generate_request_id ya mostró el error; el mismo botón sirve de reintento
+            return
 
         st.success("Quotation saved successfully to Google Sheets!")
         
-        pdf_filename = generate_quotation(quotation_data)
-
-        with open(pdf_filename, "rb") as f:
-            pdf_bytes = f.read()
+        try:
+            document = generate_quotation(quotation_data)
+        except Exception as e:
+            st.error(f"Could not generate the quotation document: {e}")
+            return
 
         st.download_button(
             label="Descargar Cotización",
-            data=pdf_bytes,
-            file_name="quotation.pdf",
+            data=document,
+            file_name=f"quotation_{quotation_data.get('request_id', contrato_id)}.xlsx",
             mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
         )
 
@@ -331,45 +371,40 @@ def show():
         SPREADSHEET_ID = st.secrets["general"]["contratos_id"]
         SHEET_NAMES = ["CONTENEDORES", "TARIFAS SCRAP EXPO"]
 
-        credentials = Credentials.from_service_account_info(
-            st.secrets["contratos_credentials"],
-            scopes=[
-                "https://www.googleapis.com/auth/spreadsheets",
-                "https://www.googleapis.com/auth/drive",
-            ]
-        )
+        drive_service = get_drive_service("contratos_credentials")
 
-        @st.cache_data(ttl=10000)
         def load_data_from_gsheets(spreadsheet_id: str, worksheet_name: str) -> pd.DataFrame:
-            gc = gspread.authorize(credentials)
-            sh = gc.open_by_key(spreadsheet_id)
-            worksheet = sh.worksheet(worksheet_name)
-            data = worksheet.get_all_values()
+            gc = get_gspread_client("contratos_credentials")
+            sh = resilient_call("sheets", gc.open_by_key, spreadsheet_id)
+            worksheet = resilient_call("sheets", sh.worksheet, worksheet_name)
+            data = resilient_call("sheets", worksheet.get_all_values)
             return pd.DataFrame(data[1:], columns=data[0]) if data else pd.DataFrame()
 
-        @st.cache_data(ttl=1000000)
-        def get_all_data(sheet_names: list):
-            return {sheet: load_data_from_gsheets(SPREADSHEET_ID, sheet) for sheet in sheet_names}
-
-        data_frames = get_all_data(SHEET_NAMES)
-        contratos_df = data_frames["CONTENEDORES"]
-        contratos_df = contratos_df[~contratos_df["Estado"].isin(["NO APROBADO", "EN PAUSA"])]
-
-        tarifas_scrap = data_frames["TARIFAS SCRAP EXPO"]
-
-        contratos_df["POL"] = contratos_df["POL"].astype(str)
-        contratos_df["POD"] = contratos_df["POD"].astype(str)
-        tarifas_scrap["POL"] = tarifas_scrap["POL"].astype(str)
-        tarifas_scrap["POD"] = tarifas_scrap["POD"].astype(str)
-
-        contratos_df['FECHA FIN FLETE'] = contratos_df['FECHA FIN FLETE'].str.strip() 
-        contratos_df['FECHA FIN FLETE'] = pd.to_datetime(contratos_df['FECHA FIN FLETE'], format='%d/%m/%Y', errors='coerce')
-        tarifas_scrap['FECHA FIN FLETE'] = pd.to_datetime(tarifas_scrap['FECHA FIN FLETE'], format='%d/%m/%Y', errors='coerce')
-
-        common_columns = list(set(contratos_df.columns) & set(tarifas_scrap.columns))
-
-        merged_df = pd.merge(contratos_df, tarifas_scrap, on=common_columns, how="outer")
-        commodity = merged_df['COMMODITIES'].dropna().unique()
+        @cached("contracts", keys=lambda sheet_names: [(SPREADSHEET_ID, sheet) for sheet in sheet_names])
+        def get_all_data(sheet_names: tuple):
+            try:
+                revision = get_drive_revision(drive_service, SPREADSHEET_ID)
+            except Exception:
+                revision = None
+
+            data_frames = {}
+            versions = []
+            for sheet in sheet_names:
+                df, meta = load_worksheet_snapshot(
+                    SPREADSHEET_ID, sheet,
+                    lambda sheet=sheet: load_data_from_gsheets(SPREADSHEET_ID, sheet),
+                    revision
+                )
+                data_frames[sheet] = df
+                versions.append((sheet, meta.get("revision"), meta.get("fetched_at")))
+            return data_frames, tuple(versions)
+
+        data_frames, data_version = get_all_data(tuple(SHEET_NAMES))
+        contracts_view = load_contracts_view(
+            data_version, data_frames["CONTENEDORES"], data_frames["TARIFAS SCRAP EXPO"]
+        )
+        merged_df = contracts_view["merged"]
+        lanes = contracts_view["lanes"]
 
         st.header("Contracts Management")
 
@@ -383,18 +418,15 @@ def show():
             st.session_state.p_destino = None
 
         with col1:
-            st.session_state.p_origen = st.selectbox("POL", merged_df["POL"].unique(), index=0)
+            st.session_state.p_origen = st.selectbox("POL", lane_pols(lanes), index=0)
 
         with col2:
             if st.session_state.p_origen:
-                destinos_disponibles = merged_df[merged_df["POL"] == st.session_state.p_origen]["POD"].unique()
+                destinos_disponibles = lane_pods(lanes, st.session_state.p_origen)
                 st.session_state.p_destino = st.selectbox("POD", destinos_disponibles)
 
         if st.session_state.p_origen and st.session_state.p_destino:
-            filtered_commodities = merged_df[
-                (merged_df["POL"] == st.session_state.p_origen) & 
-                (merged_df["POD"] == st.session_state.p_destino)
-            ]["COMMODITIES"].dropna().unique()
+            filtered_commodities = lane_commodities(lanes, st.session_state.p_origen, st.session_state.p_destino)
             st.session_state.commodity_contracts = st.multiselect("Select Commodities", filtered_commodities)
 
         if st.session_state.p_origen and st.session_state.p_destino:
@@ -402,7 +434,7 @@ def show():
             p_destino = st.session_state.p_destino
             commodity = st.session_state.commodity_contracts
 
-            contratos = merged_df[(merged_df["POL"] == p_origen) & (merged_df["POD"] == p_destino) & (merged_df["COMMODITIES"].isin(commodity)) ]
+            contratos = merged_df.iloc[lane_rows(lanes, p_origen, p_destino, commodity)]
 
             if not contratos.empty:
                 hoy = dt.datetime.now()
@@ -410,6 +442,7 @@ def show():
 
                 if not contratos_vigentes.empty:
                     contratos_agrupados = contratos_vigentes.groupby(["Línea", "No CONTRATO"])
+                    cost_tables = build_cost_tables(contratos_vigentes)
                     num_columns = 3
 
                     contrato_list = list(contratos_agrupados) 
@@ -463,36 +496,10 @@ def show():
                                         if dias_restantes <= 15:
                                             st.warning(f"⚠️ **This contract expires soon: {fecha_fin.date()}**")
 
-                                    # 🔹 Generar la tabla de costos
-                                    columnas_clave = ["ORIGEN", "FLETE", "DESTINO", "TOTAL FLETE Y ORIGEN", "HBL", "Switch", "TOTAL FLETE, ORIGEN Y DESTINO", "TOTAL FLETE, ORIGEN Y SWITCH O HBL"]
-                                    contrato_rows_validos = contrato_rows.dropna(subset=columnas_clave, how="all")
-
-                                    if not contrato_rows_validos.empty:
-                                        tabla_pivot = contrato_rows_validos.pivot_table(
-                                            index=[],
-                                            columns="TIPO CONT",
-                                            values=columnas_clave,
-                                            aggfunc=lambda x: x.iloc[0] if not x.empty else "Pendiente",
-                                            fill_value=pd.NA
-                                        )
-
-                                        if isinstance(tabla_pivot.columns, pd.MultiIndex):
-                                            available_cargo_types = tabla_pivot.columns.get_level_values(1).unique().tolist()
-                                        else:
-                                            available_cargo_types = tabla_pivot.columns.unique().tolist()
-
-                                        tabla_pivot.rename_axis("CONCEPTO", inplace=True)
-                                        nuevo_orden =  ["ORIGEN", "FLETE", "DESTINO", "TOTAL FLETE Y ORIGEN", "HBL", "Switch", "TOTAL FLETE, ORIGEN Y DESTINO", "TOTAL FLETE, ORIGEN Y SWITCH O HBL"]
-                                        tabla_pivot = tabla_pivot.reindex(nuevo_orden)
-                                        tabla_pivot.index = tabla_pivot.index.map(lambda x: x.capitalize() if isinstance(x, str) else x)
-                                        tabla_pivot.dropna(how="all", inplace=True)
-                                        tabla_pivot = tabla_pivot.astype(str)
-
-                                        tabla_pivot = tabla_pivot.loc[~(tabla_pivot.apply(lambda x: x.str.strip()).eq("").all(axis=1))]
-
-                                        tabla_pivot.dropna(axis=1, how="all", inplace=True)
-
-                                        st.table(tabla_pivot)
+                                    # 🔹 Tabla de costos (precalculada para todos los contratos)
+                                    cost_table = cost_tables.get((linea, contrato_id), EMPTY_COST_TABLE)
+                                    if not cost_table["display"].empty:
+                                        st.table(cost_table["display"])
 
                                     notas = contrato_info.get("NOTAS", "")
 
@@ -517,7 +524,7 @@ def show():
                                             "Contract ID": contrato_id,
                                             "Details": fields
                                         }
-                                        select_options(contrato_id, available_cargo_types, tabla_pivot)
+                                        select_options(contrato_id, cost_table)
 
                         st.write("\n")
             else:
@@ -10,6 +10,12 @@ import random
 import string
 import os
 from utils import get_name
+from id_allocator import CounterNotReconciledError
+from spool import clear_spool, session_spool_dir
+from drafts import remove_draft_service
+from locations import load_cities_index, load_ports_index
+from search import search_selectbox
+from finalize_jobs import ACTIVE_STATUSES, DuplicateJobError, job_status, retry_finalize_job, submit_finalize_job
 
 def show():
 
@@ -18,32 +24,43 @@ def show():
     PARENT_FOLDER_ID = st.secrets["general"]["parent_folder"]
     time_sheet_id = st.secrets["general"]["time_sheet_id"]
 
-    sheets_creds = Credentials.from_service_account_info(
-        st.secrets["google_sheets_credentials"],
-        scopes=[
-            "https://www.googleapis.com/auth/spreadsheets",
-            "https://www.googleapis.com/auth/drive",
-        ]
-    )
-
-    sheets_service = build('sheets', 'v4', credentials=sheets_creds)
-
-    drive_creds = Credentials.from_service_account_info(
-        st.secrets["google_drive_credentials"],
-        scopes=["https://www.googleapis.com/auth/drive"]
-    )
-
-    drive_service = build('drive', 'v3', credentials=drive_creds)
-
-    client_gcp = gspread.authorize(sheets_creds)
     colombia_timezone = pytz.timezone('America/Bogota')
 
     #--------------------------------------UTILITY FUNCTIONS--------------------------------
-    @st.cache_data(ttl=3600)
     def clear_temp_directory():
-        for root, _, files in os.walk(TEMP_DIR):
-            for file_name in files:
-                os.remove(os.path.join(root, file_name))
+        clear_spool(session_spool_dir())
+
+    finalize_step_labels = {
+        "folder": "Creating Drive folder",
+        "sheets": "Saving to Google Sheets",
+        "drive": "Uploading files to Google Drive",
+    }
+
+    def show_finalize_status():
+        # Devuelve True mientras alguna solicitud de esta sesión siga en proceso
+        active = False
+        for request_id in st.session_state.get("finalize_jobs", []):
+            job = job_status(request_id)
+            if job is None:
+                continue
+            if job["status"] == "done":
+                st.success(f"✅ Request {request_id} saved. [Open folder]({job['folder_link']})")
+            elif job["status"] == "failed":
+                st.error(f"Request {request_id} could not be completed: {job['last_error']}")
+                st.button("Retry", key=f"retry_{request_id}", on_click=retry_finalize_job, args=(request_id,))
+            else:
+                active = True
+                retry_note = f" (retry {job['attempts']})" if job["attempts"] else ""
+                st.info(f"⏳ Request {request_id}: {finalize_step_labels.get(job['step'], job['step'])}...{retry_note}")
+                if job["progress"] is not None:
+                    st.progress(job["progress"])
+        return active
+
+    @st.fragment(run_every=3)
+    def finalize_status_panel():
+        if not show_finalize_status():
+            # Todo terminó: se redibuja la página completa y se deja de consultar
+            st.rerun()
 
     def initialize_state():
         default_values = {
@@ -63,8 +80,6 @@ def show():
             "volume_num": "",
             "volume_frequency": "",
             "initialized": True,
-            "ports_csv": None,
-            "cities_csv": None,
             "clients_list": []
         }
         for key, value in default_values.items():
@@ -76,22 +91,21 @@ def show():
         reset_json()
         clear_temp_directory()
 
-        if "ports_csv" not in st.session_state or st.session_state["ports_csv"] is None:
-            try:
-                st.session_state["ports_csv"] = load_csv("data/output_port_world.csv")
-            except Exception as e:
-                st.error("Error loading CSV data. Please check the file path or format.")
+        # Los índices de ubicaciones se construyen una vez por proceso
+        try:
+            load_ports_index()
+        except Exception as e:
+            st.error("Error loading CSV data. Please check the file path or format.")
 
-        if "cities_csv" not in st.session_state or st.session_state["cities_csv"] is None:
-            try:
-                st.session_state["cities_csv"] = load_csv("data/cities_world.csv")
-            except Exception as e:
-                st.error("Error loading CSV data. Please check the file path or format.")
+        try:
+            load_cities_index()
+        except Exception as e:
+            st.error("Error loading CSV data. Please check the file path or format.")
 
         if "clients_list" not in st.session_state or not st.session_state["clients_list"]:
             try:
                 client_data = load_clients()
-                st.session_state["clients_list"] = client_data if client_data else []
+                st.session_state["clients_list"] = list(client_data) if client_data else []
             except Exception as e:
                 st.error(f"Error al cargar la lista de clientes: {e}")
                 st.session_state["clients_list"] = []
@@ -102,32 +116,24 @@ def show():
         if "submitted" not in st.session_state:
             st.session_state["submitted"] = False
 
-    def generate_request_id():
-        if "generated_ids" not in st.session_state:
-            st.session_state["generated_ids"] = set()
-
-        existing_ids = load_existing_ids_from_sheets()
-        new_sequence_ids = [
-            int(id[1:]) for id in existing_ids 
-            if id.startswith('Q') and id[1:].isdigit()
-        ]
-
-        if new_sequence_ids:
-            next_id = max(new_sequence_ids) + 1
-        else:
-            next_id = 1 
-
-        unique_id = f"Q{next_id:04d}"
-
-        st.session_state["generated_ids"].add(unique_id)
-        return unique_id
-
     #------------------------------------APP----------------------------------------
     col1, col2, col3 = st.columns([1, 2, 1])
 
     if "initialized" not in st.session_state or not st.session_state["initialized"]:
         initialize_state()
 
+    if st.session_state.get("finalize_jobs"):
+        if any((job_status(request_id) or {}).get("status") in ACTIVE_STATUSES
+               for request_id in st.session_state["finalize_jobs"]):
+            finalize_status_panel()
+        else:
+            show_finalize_status()
+            # Las completadas se muestran una vez; las fallidas quedan para reintentar
+            st.session_state["finalize_jobs"] = [
+                request_id for request_id in st.session_state["finalize_jobs"]
+                if (job_status(request_id) or {}).get("status") == "failed"
+            ]
+
     if st.session_state["completed"]:
         if st.session_state.get("start_time") is None:
             st.session_state["start_time"] = datetime.now(colombia_timezone)
@@ -144,7 +150,7 @@ def show():
             if "clients_list" not in st.session_state or not st.session_state["clients_list"]:
                 try:
                     clients_list = load_clients() 
-                    st.session_state["clients_list"] = clients_list if clients_list else []
+                    st.session_state["clients_list"] = list(clients_list) if clients_list else []
                 except Exception as e:
                     st.error(f"⚠️ Error cargando la lista de clientes desde Google Sheets: {e}")
                     st.session_state["clients_list"] = []
@@ -152,7 +158,7 @@ def show():
 
             clients_list = st.session_state.get("clients_list", [])
 
-            client = st.selectbox("Who is your client?*", [" "] + ["+ Add New"] + clients_list, key="client_input")
+            client = search_selectbox("Who is your client?*", clients_list, key="client_input", fixed=[" ", "+ Add New"])
             reference = st.text_input("Client reference", key="reference")
 
             new_client_saved = st.session_state.get("new_client_saved", False)
@@ -353,14 +359,8 @@ def show():
                     change_page("client_data")
 
                 def handle_delete(service_index):
-                    removed_service = st.session_state["services"].pop(service_index)
-                    services_json = load_services()
-
-                    updated_services = [
-                        s for s in services_json
-                        if s["details"] != removed_service["details"] or s["service"] != removed_service["service"]
-                    ]
-                    save_services(updated_services)
+                    st.session_state["services"].pop(service_index)
+                    remove_draft_service(service_index)
                     st.success(f"Service {service_index + 1} has been removed!")
                     if not st.session_state["services"]:
                         change_page("client_name")
@@ -397,9 +397,6 @@ def show():
 
                 with col2:
                     with col2:
-                        if "df_all_quotes" not in st.session_state:
-                            st.session_state["df_all_quotes"] = pd.DataFrame()
-
                         if st.session_state.get("quotation_completed", False):
                             st.session_state.clear()
                             change_page("select_sales_rep")
@@ -411,67 +408,36 @@ def show():
                                 return
                             
                             if not st.session_state.get("request_id"): 
-                                st.session_state["request_id"] = generate_request_id()
+                                try:
+                                    st.session_state["request_id"] = generate_request_id()
+                                except CounterNotReconciledError:
+                                    # generate_request_id ya mostró el error; el botón sirve de reintento
+                                    return
 
                             request_id = st.session_state["request_id"]
 
                             services = load_services()
                             if services:
                                 try:
-                                    if "folder_request_id" not in st.session_state:
-                                        st.session_state["folder_request_id"] = None
-
-                                    if "folder_id" not in st.session_state or st.session_state["folder_request_id"] != request_id:
-                                        if st.session_state["folder_request_id"] is None:
-                                            folder_id, folder_link = folder(request_id)
-                                            st.session_state["folder_id"] = folder_id
-                                            st.session_state["folder_link"] = folder_link
-                                            st.session_state["folder_request_id"] = request_id
-
-                                            st.session_state["end_time"] = datetime.now(colombia_timezone)
-                                            end_time = st.session_state.get("end_time", None)
-                                            if end_time is not None:
-                                                end_time_str = end_time.strftime('%Y-%m-%d %H:%M:%S')
-                                            else:
-                                                st.error("Error: 'end_time' no fue asignado correctamente.")
-                                                return
-
-                                            # ✅ Asegurar que 'start_time' existe antes de calcular la duración
-                                            start_time = st.session_state.get("start_time", None)
-                                            if start_time and end_time:
-                                                duration = (end_time - start_time).total_seconds()
-                                            else:
-                                                st.error("Error: 'start_time' o 'end_time' no están definidos. No se puede calcular la duración.")
-                                                return
-
-                                            log_time(st.session_state["start_time"], end_time, duration, st.session_state["request_id"], quotation_type="Requested Quotation")
-                                            st.session_state["submitted"] = True
-                                        else:
-                                            folder_id = st.session_state["folder_id"]
-                                            folder_link = st.session_state["folder_link"]
+                                    end_time = datetime.now(colombia_timezone)
+                                    end_time_str = end_time.strftime('%Y-%m-%d %H:%M:%S')
 
-                                    folder_id = st.session_state.get("folder_id", "No folder created")
-
-                                    if not folder_id:
-                                        st.error("Failed to create or retrieve folder. Aborting finalization.")
+                                    # ✅ Asegurar que 'start_time' existe antes de calcular la duración
+                                    start_time = st.session_state.get("start_time", None)
+                                    if not start_time:
+                                        st.error("Error: 'start_time' no está definido. No se puede calcular la duración.")
                                         return
+                                    duration = (end_time - start_time).total_seconds()
 
                                     commercial = st.session_state.get("sales_rep", "Unknown")
                                     client = st.session_state["client"]
                                     client_reference = st.session_state.get("client_reference", "N/A")
-                                    folder_link = st.session_state.get("folder_link", "N/A")
-
-                                    if client and client not in st.session_state["clients_list"]:
-                                        sheet = client_gcp.open_by_key(time_sheet_id)
-                                        worksheet = sheet.worksheet("clientes")
-                                        worksheet.append_row([client])
-                                        st.session_state["clients_list"].append(client)
-                                        st.success(f"✅ Client '{client}' successfully saved")
-                                        load_clients.clear()
+                                    new_client = client if client and client not in st.session_state["clients_list"] else None
 
                                     grouped_record = {
                                         "time": end_time_str,
-                                        "request_id": f'=HYPERLINK("{folder_link}"; "{st.session_state["request_id"]}")',
+                                        # El enlace a la carpeta de Drive lo agrega el trabajo de finalización
+                                        "request_id": request_id,
                                         "commercial": commercial,
                                         "client": client,
                                         "client_reference": client_reference,
@@ -703,31 +669,28 @@ def show():
                                     for key, value_set in all_details.items():
                                         grouped_record[key] = "\n".join(sorted(value_set))
 
-                                    # **9️⃣ Crear DataFrame y guardar**
-                                    new_df = pd.DataFrame([grouped_record])
-
-                                    new_df = new_df.reindex(columns=all_quotes_columns, fill_value="")
-
-                                    st.session_state["df_all_quotes"] = pd.concat(
-                                        [st.session_state.get("df_all_quotes", pd.DataFrame()), new_df],
-                                        ignore_index=True
-                                    )
+                                    # **9️⃣ Registrar la solicitud: Drive y Sheets se completan en segundo plano**
+                                    submit_finalize_job(request_id, {
+                                        "record": grouped_record,
+                                        "start_time": start_time.isoformat(),
+                                        "end_time": end_time.isoformat(),
+                                        "duration": duration,
+                                        "new_client": new_client,
+                                    }, spool_dir=session_spool_dir())
 
-                                    save_to_google_sheets(st.session_state["df_all_quotes"], sheet_id)
-
-                                    del st.session_state["request_id"]
-                                    upload_all_files_to_google_drive(folder_id, drive_service)
-                                    clear_temp_directory()
+                                    finalize_jobs = st.session_state.get("finalize_jobs", []) + [request_id]
                                     reset_json()
-                                    st.session_state["services"] = []
-                                    st.session_state["start_time"] = None
-                                    st.session_state["end_time"] = None
-                                    st.session_state["quotation_completed"] = False
-                                    st.session_state["page"] = "client_name"
-                                    st.success(f"Quotation completed! Your request ID is {request_id}")
                                     st.session_state.clear()
+                                    st.session_state["finalize_jobs"] = finalize_jobs
+                                    st.success(f"Quotation received! Your request ID is {request_id}")
                                     change_page("select_sales_rep")
 
+                                except DuplicateJobError as e:
+                                    # El ID ya pertenece a otra solicitud: el próximo intento pide uno nuevo
+                                    st.error(f"{e} Press 'Finalize Quotation' again to get a new request ID.")
+                                    st.session_state.pop("request_id", None)
+                                    st.session_state["submitted"] = False
+
                                 except Exception as e:
                                     st.error(f"An error occurred: {str(e)}")
                                     st.session_state["submitted"] = False
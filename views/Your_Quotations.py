@@ -4,15 +4,16 @@ import gspread
 from google.oauth2.service_account import Credentials
 import json
 import os
-import re
 from utils import identity_role
-from st_aggrid import AgGrid, GridOptionsBuilder
-
-def clean_text(value):
-    if isinstance(value, str):
-        value = value.replace("\n", " ") 
-        value = " ".join(value.split()) 
-    return value
+from sheet_sync import memory_budget, memory_report, sync_worksheet, worksheet_version
+from clients import get_gspread_client
+from paging import paged_grid
+from cache_manager import cache_stats
+from write_queue import failed_rows
+from resilience import get_metrics
+from role_views import member_view, owner_view
+from request_routes import load_request_routes, load_transport_combo, route_options, rows_with_route
+from tag_index import bitmap_from_positions, bitmap_to_mask, load_tag_index, rows_with_tags, tag_options
 
 @st.dialog("Quotation Details", width="large")
 def show_dialog():
@@ -43,36 +44,34 @@ def show():
     quotations_requested = st.secrets["general"]["quotations_requested"]
     quotations_contracts = st.secrets["general"]["costs_sales_contracts"]
 
-    creds = Credentials.from_service_account_info(
-        st.secrets["google_sheets_credentials"],
-        scopes=["https://www.googleapis.com/auth/spreadsheets"]
-    )
+    client = get_gspread_client()
 
-    client = gspread.authorize(creds)
+    loaded_sheets = []
 
-    @st.cache_data(ttl=1800)
     def load_data_from_sheets(sheet_id: str, worksheet_name: str) -> pd.DataFrame:
-        try:
-            sheet = client.open_by_key(sheet_id)
-            worksheet = sheet.worksheet(worksheet_name)
-            data = worksheet.get_all_records()
-            df = pd.DataFrame(data)
+        loaded_sheets.append((sheet_id, worksheet_name))
+        return sync_worksheet(client, sheet_id, worksheet_name)
+
+    def data_version(*worksheets):
+        return tuple((sheet_id, worksheet_name, worksheet_version(sheet_id, worksheet_name))
+                     for sheet_id, worksheet_name in loaded_sheets if worksheet_name in worksheets)
 
-            return df
-        except Exception as e:
-            st.error(f"Error al cargar datos desde Google Sheets ({worksheet_name}): {str(e)}")
-            return pd.DataFrame()
+    def refresh_data():
+        # Recarga completa de las hojas que usa esta vista
+        for sheet_id, worksheet_name in loaded_sheets:
+            sync_worksheet(client, sheet_id, worksheet_name, force=True)
 
     name = st.experimental_user.name
     email = st.experimental_user.email
 
     role = identity_role(email)
 
+    # Los usuarios con filtro leen su partición, mantenida por sheet_sync a medida que llegan filas
     if role == "commercial":
-        request_df = load_data_from_sheets(quotations_requested, "All Quotes")
-        contracts_df = load_data_from_sheets(quotations_contracts, "CONTRATOS")
-        request_df = request_df[request_df["COMMERCIAL"] == name]
-        contracts_df = contracts_df[contracts_df["Commercial"] == name]
+        load_data_from_sheets(quotations_requested, "All Quotes")
+        load_data_from_sheets(quotations_contracts, "CONTRATOS")
+        request_df = owner_view(quotations_requested, "All Quotes", "COMMERCIAL", name)
+        contracts_df = owner_view(quotations_contracts, "CONTRATOS", "Commercial", name)
     elif role == "pricing":
         request_df = load_data_from_sheets(quotations_requested, "All Quotes")
         contracts_df = load_data_from_sheets(quotations_contracts, "CONTRATOS")
@@ -84,7 +83,7 @@ def show():
         }
         if email in name_map:
             name = name_map[email]
-            request_df = request_df[request_df["ASSIGNED_TO"].apply(lambda x: name in [correo.strip() for correo in str(x).split(",")])]
+            request_df = member_view(quotations_requested, "All Quotes", "ASSIGNED_TO", name)
     elif role == "ground":
         request_df = load_data_from_sheets(quotations_requested, "Ground Quotations")
         contracts_df = pd.DataFrame()
@@ -105,9 +104,26 @@ def show():
         with col3:
             st.write(" ")
             if st.button("Refresh Data", key="button_1"):
-                load_data_from_sheets.clear() 
+                refresh_data()
                 st.rerun()
 
+        if role == "admin":
+            with st.expander("Memory, cache and Google API usage"):
+                used_mb, budget_mb = memory_budget()
+                st.caption(f"Synced tables and derived views: {used_mb} MB of a {budget_mb} MB budget")
+                if used_mb > budget_mb:
+                    st.warning("⚠️ The synced tables alone exceed the memory budget; derived views are rebuilt on demand.")
+                st.dataframe(memory_report(), hide_index=True)
+                st.dataframe(pd.DataFrame(cache_stats()), hide_index=True)
+                # Llamadas, reintentos, cortes y estado del circuito por endpoint de Google
+                st.dataframe(pd.DataFrame.from_dict(get_metrics(), orient="index").rename_axis("Endpoint"))
+
+            failed = failed_rows()
+            if failed:
+                st.warning(f"⚠️ {len(failed)} row(s) could not be written to Google Sheets after several attempts.")
+                with st.expander("Failed Sheets writes"):
+                    st.dataframe(pd.DataFrame(failed), hide_index=True)
+
     with tabs[1]:
 
         col1, col2, col3 = st.columns([1,  1, 0.3])
@@ -116,95 +132,78 @@ def show():
         with col3:
             st.write(" ")
             if st.button("Refresh Data", key="button_2"):
-                load_data_from_sheets.clear() 
+                refresh_data()
                 st.rerun()
 
-        df_full = request_df.copy()
+        df_full = request_df
 
         if df_full is None or df_full.empty:
             st.error("No data available. Try to update")
             df_filtered = pd.DataFrame()
         else:
-            def extraer_origen_destino(rutas):
-                origens, destinos = [], []
-                for ruta in rutas.splitlines():
-                    matches = re.findall(r"\((.*?)\)", ruta)
-                    if len(matches) > 0:
-                        origens.append(matches[0]) 
-                    if len(matches) > 1:
-                        destinos.append(matches[1])  
-                return {"origen": origens, "destino": destinos}
-
-            def combine_transport_modality(row):
-                if row['TRANSPORT_TYPE'] == "Maritime":
-                    return f"{row['TRANSPORT_TYPE']} - {row['MODALITY']}"
-                else:
-                    return row['TRANSPORT_TYPE']
-
-            df_full[["origen", "destino"]] = df_full["ROUTES_INFO"].apply(
-                lambda x: pd.Series(extraer_origen_destino(x))
-            )
-
-            df_full['TRANSPORT_COMBO'] = df_full.apply(combine_transport_modality, axis=1)
+            # Rutas y modalidad se calculan al sincronizar la hoja, no en cada interacción
+            request_sheet = "Ground Quotations" if role == "ground" else "All Quotes"
+            routes = load_request_routes(quotations_requested, request_sheet)
+            routes = routes[routes["row"].isin(df_full.index)]
+            # Serie aparte alineada por fila: la tabla sincronizada se comparte entre sesiones y no se modifica
+            transport_combo = load_transport_combo(quotations_requested, request_sheet).reindex(df_full.index)
+
+            # Valores de SERVICE y TYPE_CONTAINER separados por "," ";" o salto de línea, indexados por fila
+            service_index = load_tag_index(quotations_requested, request_sheet, "SERVICE")
+            container_index = load_tag_index(quotations_requested, request_sheet, "TYPE_CONTAINER")
+            total_rows = service_index["rows"]
+            visible_rows = None if len(df_full) == total_rows else bitmap_from_positions(df_full.index, total_rows)
 
-            df_filtered = df_full.copy()
             col1, col2, col3 = st.columns(3)
             col4, col5, col6 = st.columns(3)
 
             with col1:
-                origen_options = sorted(set(o for sublist in df_full["origen"].dropna() for o in sublist))
+                origen_options = route_options(routes, "origen")
                 selected_origen = st.multiselect('**Port of Origin**', origen_options, key="origen")
 
             with col2:
-                destino_options = sorted(set(d for sublist in df_full["destino"].dropna() for d in sublist))
+                destino_options = route_options(routes, "destino")
                 selected_destino = st.multiselect('**Port of Destination**', destino_options, key="destino")
 
             with col3:
-                all_services = set()
-                for service in df_full['SERVICE'].dropna():
-                    splitted = re.split(r'[,\n;]+', service)
-                    splitted = [item.strip() for item in splitted if item.strip() != ""]
-                    all_services.update(splitted)
-                service_options = sorted(all_services)
+                service_options = tag_options(service_index, visible_rows)
                 selected_service = st.multiselect('**Service Requested**', service_options, key="service")
 
             with col4:
-                transport_options = sorted(df_full['TRANSPORT_COMBO'].dropna().unique())
+                transport_options = sorted(transport_combo.dropna().unique())
                 selected_transport = st.multiselect("**Transport/Modality**", transport_options)
 
             with col5: 
-                all_containers = set()
-                for container_str in df_full['TYPE_CONTAINER'].dropna():
-                    splitted = re.split(r'[,\n;]+', container_str)
-                    splitted = [item.strip() for item in splitted if item.strip() != ""]
-                    all_containers.update(splitted)
-                container_options = sorted(all_containers)
+                container_options = tag_options(container_index, visible_rows)
                 selected_container = st.multiselect('**Container Type**', container_options, key="cont_type")
 
             with col6:
                 client_options = sorted(df_full['CLIENT'].dropna().unique())
                 selected_client = st.multiselect('**Client**', client_options, key="client")
 
-            df_filtered = df_full.copy()
+            request_mask = pd.Series(True, index=df_full.index)
 
             if selected_origen:
-                df_filtered = df_filtered[df_filtered["origen"].apply(lambda x: any(o in x for o in selected_origen))]
+                request_mask &= df_full.index.isin(rows_with_route(routes, "origen", selected_origen))
             if selected_destino:
-                df_filtered = df_filtered[df_filtered["destino"].apply(lambda x: any(d in x for d in selected_destino))]
+                request_mask &= df_full.index.isin(rows_with_route(routes, "destino", selected_destino))
             if selected_client:
-                df_filtered = df_filtered[df_filtered["CLIENT"].isin(selected_client)]
+                request_mask &= df_full["CLIENT"].isin(selected_client)
+            # Un bitmap por filtro (OR entre los valores elegidos) y AND entre filtros
+            tag_filter = -1
             if selected_service:
-                df_filtered = df_filtered[df_filtered["SERVICE"].isin(selected_service)]
+                tag_filter &= rows_with_tags(service_index, selected_service)
             if selected_container:
-                def row_has_container(container_str, selected):
-                    splitted = [item.strip() for item in re.split(r'[,\n;]+', str(container_str)) if item.strip()]
-                    return any(cont in splitted for cont in selected)
-                df_filtered = df_filtered[df_filtered["TYPE_CONTAINER"].apply(lambda x: row_has_container(x, selected_container))]
+                tag_filter &= rows_with_tags(container_index, selected_container)
+            if tag_filter != -1:
+                request_mask &= bitmap_to_mask(tag_filter, total_rows)[df_full.index]
             if selected_transport:
-                df_filtered = df_filtered[df_filtered["TRANSPORT_COMBO"].isin(selected_transport)]
+                request_mask &= transport_combo.isin(selected_transport)
+
+            df_filtered = df_full[request_mask]
 
             request_quantity = df_filtered.shape[0]
-            counts = df_filtered["TRANSPORT_COMBO"].value_counts()
+            counts = transport_combo[request_mask].value_counts()
             maritime_fcl_count = counts.get("Maritime - FCL", 0)
             maritime_lcl_count = counts.get("Maritime - LCL", 0)
             air_count = counts.get("Air", 0)
@@ -218,28 +217,14 @@ def show():
 
         # -------------------- DATAFRAME --------------------
         if not df_filtered.empty:
-            gb = GridOptionsBuilder.from_dataframe(df_filtered)
             visible_columns = ["REQUEST_ID", "CLIENT", "ROUTES_INFO", "INCOTERM", 
                             "COMMODITY", "TRANSPORT_TYPE", "MODALITY", 
                             "TYPE_CONTAINER", "STATUS", "DESTINATION", "CUSTOMER"]
 
-            for col in df_filtered.columns:
-                if col not in visible_columns:
-                    gb.configure_column(col, hide=True)
-                else:
-                    gb.configure_column(col)
-
-            gb.configure_pagination(paginationAutoPageSize=False, paginationPageSize=20)  
-            gb.configure_selection("single", use_checkbox=True)  
-            gb.configure_grid_options(domLayout='autoHeight')
-
-            grid_options = gb.build()
-
-            grid_response = AgGrid(df_filtered, gridOptions=grid_options, 
-                        enable_enterprise_modules=True, 
-                        fit_columns_on_grid_load=True, height=600)
-
-            selected_rows = grid_response.get("selected_rows")
+            selected_rows = paged_grid(
+                df_full, request_mask, (data_version("All Quotes", "Ground Quotations"), role, name),
+                key="requests", visible_columns=visible_columns
+            )
 
             if selected_rows is not None and len(selected_rows) > 0:
                 selected_df = pd.DataFrame(selected_rows)
@@ -270,17 +255,15 @@ def show():
         with col3:
             st.write(" ")
             if st.button("Refresh Data", key="button_3"):
-                load_data_from_sheets.clear() 
+                refresh_data()
                 st.rerun()
 
-        df_full = contracts_df.copy()
+        df_full = contracts_df
         if df_full is None or df_full.empty:
             st.error("No data available. Try to update")
             df_filtered = pd.DataFrame()
 
         else:
-            df_full["Time"] = pd.to_datetime(df_full["Time"], errors="coerce")
-
             col1, col2, col3 = st.columns(3)
             col4, col5 = st.columns(2)
             with col1:
@@ -299,20 +282,19 @@ def show():
                 cliente_op = sorted(df_full['Cliente'].dropna().unique())
                 selected_client = st.multiselect("**Client**", cliente_op)
 
-            df_filtered = df_full.copy()
+            contract_mask = pd.Series(True, index=df_full.index)
             if selected_date:
-                df_filtered = df_filtered[df_filtered["Time"].dt.date == selected_date]
+                contract_mask &= df_full["Time"].dt.date == selected_date
             if selected_origin:
-                df_filtered = df_filtered[df_filtered["POL"].apply(lambda x: any(o in x for o in selected_origin))]
+                contract_mask &= df_full["POL"].isin(selected_origin)
             if selected_destination:
-                df_filtered = df_filtered[df_filtered["POD"].apply(lambda x: any(o in x for o in selected_destination))]
+                contract_mask &= df_full["POD"].isin(selected_destination)
             if selected_cargo:
-                df_filtered = df_filtered[df_filtered["Cargo Types"].apply(lambda x: any(o in x for o in selected_cargo))]
+                contract_mask &= df_full["Cargo Types"].apply(lambda x: any(o in x for o in selected_cargo))
             if selected_client:
-                df_filtered = df_filtered[df_filtered["Cliente"].apply(lambda x: any(o in x for o in selected_client))]
-            
-            df_filtered['Total Sale'] = df_filtered['Total Sale'].str.replace('$', '', regex=False).astype(float)
-            df_filtered['Total Profit'] = df_filtered['Total Profit'].str.replace('$', '', regex=False).astype(float)
+                contract_mask &= df_full["Cliente"].isin(selected_client)
+
+            df_filtered = df_full[contract_mask]
 
             quotations_quantity = df_filtered.shape[0]
             total_sale = df_filtered['Total Sale'].sum()
@@ -324,21 +306,10 @@ def show():
             col3.metric(label="Total Profit", value=f"${total_profit}")
 
             if not df_filtered.empty:
-                for col in df_filtered.select_dtypes(include=["object"]).columns:
-                    df_filtered[col] = df_filtered[col].apply(clean_text)
-
-                gb = GridOptionsBuilder.from_dataframe(df_filtered)
-                gb.configure_pagination(paginationAutoPageSize=True, paginationPageSize=20) 
-                gb.configure_selection("single", use_checkbox=True)  
-                gb.configure_grid_options(domLayout='autoHeight')
-
-                grid_options = gb.build()
-
-                grid_response = AgGrid(df_filtered, gridOptions=grid_options, 
-                                enable_enterprise_modules=True, 
-                                fit_columns_on_grid_load=True, height=600)
-
-                selected_rows = grid_response.get("selected_rows")
+                selected_rows = paged_grid(
+                    df_full, contract_mask, (data_version("CONTRATOS"), role, name),
+                    key="contracts"
+                )
 
                 if selected_rows is not None and len(selected_rows) > 0:
                     df_contracts = pd.DataFrame(selected_rows)
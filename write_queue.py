@@ -0,0 +1,284 @@
+import json
+import logging
+import math
+import random
+import threading
+import time
+
+import streamlit as st
+
+from clients import get_sheets_service
+from local_store import get_connection
+from resilience import BASE_DELAY, MAX_DELAY, RESET_TIMEOUT, CircuitOpenError, resilient_call
+
+FLUSH_INTERVAL = 2
+MAX_ATTEMPTS = 5
+# Las filas escritas se guardan un tiempo para que las claves repetidas se sigan descartando
+FLUSHED_RETENTION = 7 * 24 * 3600
+PRUNE_INTERVAL = 3600
+
+logger = logging.getLogger(__name__)
+
+_retry_at = {}
+_sheet_id_cache = {}
+
+# Dict de módulo (no st.cache_resource): los hooks se leen desde el hilo de escritura, sin ScriptRunContext
+_flush_hooks = {}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS pending_rows (
+    row_key TEXT PRIMARY KEY,
+    spreadsheet_id TEXT NOT NULL,
+    sheet_name TEXT NOT NULL,
+    header_json TEXT,
+    row_json TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    last_error TEXT,
+    created_at REAL NOT NULL
+)
+"""
+
+
+def add_flush_hook(name, hook):
+    # hook(spreadsheet_id, sheet_names) se llama después de confirmar filas en esas hojas
+    _flush_hooks[name] = hook
+
+
+def _run_flush_hooks(spreadsheet_id, sheet_names):
+    for name, hook in list(_flush_hooks.items()):
+        try:
+            hook(spreadsheet_id, sheet_names)
+        except Exception as e:
+            logger.exception("Error en el hook de escritura %s: %s", name, e)
+
+
+def _connection():
+    conn = get_connection()
+    conn.execute(_SCHEMA)
+    return conn
+
+
+def enqueue_rows(spreadsheet_id, sheet_name, rows, keys, header=None):
+    # La clave de idempotencia evita duplicar filas si la misma solicitud se encola o reintenta
+    now = time.time()
+    header_json = json.dumps(header) if header else None
+    conn = _connection()
+    with conn:
+        conn.executemany(
+            "INSERT OR IGNORE INTO pending_rows (row_key, spreadsheet_id, sheet_name, header_json, row_json, created_at) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            [(key, spreadsheet_id, sheet_name, header_json, json.dumps(row, default=str), now + i * 1e-6)
+             for i, (key, row) in enumerate(zip(keys, rows))]
+        )
+    get_write_worker()["event"].set()
+
+
+def _cell(value):
+    if value is None or (isinstance(value, float) and math.isnan(value)):
+        return {}
+    if isinstance(value, bool):
+        return {"userEnteredValue": {"boolValue": value}}
+    if isinstance(value, (int, float)):
+        return {"userEnteredValue": {"numberValue": value}}
+    return {"userEnteredValue": {"stringValue": str(value)}}
+
+
+def _append_request(sheet_id, rows):
+    return {
+        "appendCells": {
+            "sheetId": sheet_id,
+            "rows": [{"values": [_cell(value) for value in row]} for row in rows],
+            "fields": "userEnteredValue",
+        }
+    }
+
+
+def _sheet_ids(service, spreadsheet_id):
+    # Los ids de las pestañas se piden una vez por hoja; si un envío falla se vuelven a pedir
+    if spreadsheet_id not in _sheet_id_cache:
+        metadata = resilient_call("sheets", service.spreadsheets().get(
+            spreadsheetId=spreadsheet_id,
+            fields="sheets.properties(sheetId,title)"
+        ).execute)
+        _sheet_id_cache[spreadsheet_id] = {
+            s["properties"]["title"]: s["properties"]["sheetId"] for s in metadata.get("sheets", [])
+        }
+    return _sheet_id_cache[spreadsheet_id]
+
+
+def _written_keys(service, spreadsheet_id, sheet_names):
+    # Tras un fallo ambiguo se revisa la columna A para no volver a escribir lo que ya llegó
+    response = resilient_call("sheets", service.spreadsheets().values().batchGet(
+        spreadsheetId=spreadsheet_id,
+        ranges=[f"'{name}'!A:A" for name in sheet_names]
+    ).execute)
+    written = {}
+    for name, value_range in zip(sheet_names, response.get("valueRanges", [])):
+        written[name] = {row[0] for row in value_range.get("values", []) if row}
+    return written
+
+
+def _flush_spreadsheet(service, spreadsheet_id, pending):
+    conn = _connection()
+    by_sheet = {}
+    for row_key, sheet_name, header_json, row_json, attempts in pending:
+        by_sheet.setdefault(sheet_name, []).append((row_key, header_json, json.loads(row_json), attempts))
+
+    sheet_ids = _sheet_ids(service, spreadsheet_id)
+
+    confirmed = set()
+    retried = [name for name, items in by_sheet.items() if name in sheet_ids and any(item[3] > 0 for item in items)]
+    if retried:
+        written = _written_keys(service, spreadsheet_id, retried)
+        for name in retried:
+            done = [item for item in by_sheet[name] if item[2] and str(item[2][0]) in written[name]]
+            with conn:
+                conn.executemany("UPDATE pending_rows SET status = 'flushed' WHERE row_key = ?",
+                                 [(item[0],) for item in done])
+            by_sheet[name] = [item for item in by_sheet[name] if item not in done]
+            if done:
+                confirmed.add(name)
+
+    requests = []
+    header_rows = {}
+    missing = [name for name in by_sheet if name not in sheet_ids and by_sheet[name]]
+    if missing:
+        response = resilient_call("sheets.write", service.spreadsheets().batchUpdate(
+            spreadsheetId=spreadsheet_id,
+            body={"requests": [{"addSheet": {"properties": {"title": name}}} for name in missing]}
+        ).execute, idempotent=False)
+        for reply in response.get("replies", []):
+            properties = reply["addSheet"]["properties"]
+            sheet_ids[properties["title"]] = properties["sheetId"]
+            header_json = next((item[1] for item in by_sheet[properties["title"]] if item[1]), None)
+            if header_json:
+                header_rows[properties["title"]] = json.loads(header_json)
+
+    flushed = []
+    for name, items in by_sheet.items():
+        if not items:
+            continue
+        rows = [item[2] for item in items]
+        if name in header_rows:
+            rows.insert(0, header_rows[name])
+        requests.append(_append_request(sheet_ids[name], rows))
+        flushed.extend(item[0] for item in items)
+        confirmed.add(name)
+
+    if requests:
+        # appendCells no es idempotente: el reintento lo hace la cola tras revisar la columna A
+        resilient_call("sheets.write", service.spreadsheets().batchUpdate(
+            spreadsheetId=spreadsheet_id, body={"requests": requests}
+        ).execute, idempotent=False)
+
+    with conn:
+        conn.executemany("UPDATE pending_rows SET status = 'flushed' WHERE row_key = ?", [(key,) for key in flushed])
+
+    if confirmed:
+        _run_flush_hooks(spreadsheet_id, confirmed)
+
+
+def flush_pending(service):
+    conn = _connection()
+    pending = conn.execute(
+        "SELECT spreadsheet_id, row_key, sheet_name, header_json, row_json, attempts FROM pending_rows "
+        "WHERE status = 'pending' ORDER BY created_at"
+    ).fetchall()
+
+    by_spreadsheet = {}
+    for spreadsheet_id, *item in pending:
+        by_spreadsheet.setdefault(spreadsheet_id, []).append(item)
+
+    for spreadsheet_id, items in by_spreadsheet.items():
+        if time.monotonic() < _retry_at.get(spreadsheet_id, 0):
+            continue
+        try:
+            _flush_spreadsheet(service, spreadsheet_id, items)
+            _retry_at.pop(spreadsheet_id, None)
+        except CircuitOpenError:
+            _retry_at[spreadsheet_id] = time.monotonic() + RESET_TIMEOUT
+        except Exception as e:
+            # Una pestaña borrada o renombrada deja ids viejos: el próximo intento los vuelve a leer
+            _sheet_id_cache.pop(spreadsheet_id, None)
+            attempts = max(item[4] for item in items) + 1
+            _retry_at[spreadsheet_id] = time.monotonic() + random.uniform(0, min(MAX_DELAY, BASE_DELAY * 2 ** attempts))
+            with conn:
+                conn.executemany(
+                    "UPDATE pending_rows SET attempts = attempts + 1, last_error = ?, "
+                    "status = CASE WHEN attempts + 1 >= ? THEN 'failed' ELSE status END "
+                    "WHERE row_key = ? AND status = 'pending'",
+                    [(str(e), MAX_ATTEMPTS, item[0]) for item in items]
+                )
+            keys = [item[0] for item in items]
+            dropped = conn.execute(
+                f"SELECT row_key, sheet_name FROM pending_rows WHERE status = 'failed' "
+                f"AND row_key IN ({', '.join('?' * len(keys))})", keys
+            ).fetchall()
+            for row_key, sheet_name in dropped:
+                logger.error("Fila descartada tras %s intentos: %s (%s / %s): %s",
+                             MAX_ATTEMPTS, row_key, spreadsheet_id, sheet_name, e)
+
+
+def failed_rows():
+    # Filas que la cola dejó de reintentar: quedan en la base local para revisarlas o reencolarlas
+    return [
+        {"Key": row_key, "Spreadsheet": spreadsheet_id, "Sheet": sheet_name, "Attempts": attempts, "Error": last_error}
+        for row_key, spreadsheet_id, sheet_name, attempts, last_error in _connection().execute(
+            "SELECT row_key, spreadsheet_id, sheet_name, attempts, last_error FROM pending_rows "
+            "WHERE status = 'failed' ORDER BY created_at"
+        ).fetchall()
+    ]
+
+
+def row_status(keys):
+    # Estado de cada clave en la cola: 'pending', 'flushed', 'failed' o None si nunca se encoló
+    statuses = dict.fromkeys(keys)
+    if keys:
+        statuses.update(_connection().execute(
+            f"SELECT row_key, status FROM pending_rows WHERE row_key IN ({', '.join('?' * len(keys))})", list(keys)
+        ).fetchall())
+    return statuses
+
+
+def retry_rows(keys):
+    # Vuelve a poner en cola las filas descartadas, con los intentos en cero
+    if not keys:
+        return
+    with _connection() as conn:
+        conn.execute(
+            "UPDATE pending_rows SET status = 'pending', attempts = 0 "
+            f"WHERE status = 'failed' AND row_key IN ({', '.join('?' * len(keys))})", list(keys)
+        )
+    get_write_worker()["event"].set()
+
+
+def prune_flushed():
+    with _connection() as conn:
+        conn.execute("DELETE FROM pending_rows WHERE status = 'flushed' AND created_at < ?",
+                     (time.time() - FLUSHED_RETENTION,))
+
+
+def _run(event):
+    service = get_sheets_service()
+    pruned_at = 0.0
+    while True:
+        event.wait(FLUSH_INTERVAL)
+        # Pequeña espera para agrupar en una sola llamada las filas que llegan juntas
+        time.sleep(0.5)
+        event.clear()
+        try:
+            flush_pending(service)
+            if time.monotonic() - pruned_at > PRUNE_INTERVAL:
+                prune_flushed()
+                pruned_at = time.monotonic()
+        except Exception as e:
+            logger.exception("Error en la cola de escritura a Google Sheets: %s", e)
+
+
+@st.cache_resource
+def get_write_worker():
+    event = threading.Event()
+    thread = threading.Thread(target=_run, args=(event,), daemon=True, name="sheets-write-queue")
+    thread.start()
+    return {"event": event, "thread": thread}